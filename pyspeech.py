@@ -112,12 +112,14 @@ Specific to Raspberry Pi:
         pip install pillow
         pip install pyaudio
         pip install RPi.GPIO
+        pip install numpy
+        pip install soundfile   # optional, makes the audio upload smaller
      
 
     Note that when run you will see 10 or so lines of errors about sockets and JACKD and whatnot.
     Don't worry, it is still working. If you know how to fix this, please let me know.
 
-    Also note that errors from the audio subsystem are ignored in recordAudioFromMicrophone(). If 
+    Also note that errors from the audio subsystem are ignored in AudioEngine.open(). If 
     you are having some real audio issue, you might change the error handler to print the errors.
 
     If you want to make this run on boot, then see the comments in s2p.desktop
@@ -142,7 +144,8 @@ import platform
 import argparse
 import logging
 from logging.handlers import TimedRotatingFileHandler
-import urllib.request
+import io
+import urllib.parse
 import time
 import datetime
 import shutil
@@ -151,13 +154,26 @@ import os
 import select
 import sys
 import random
+import math
 import tkinter as tk
 import json
 import string
+import asyncio
+import wave
+import hashlib
+import base64
+import functools
+import threading
+import concurrent.futures
+import queue
+from queue import Queue
+from collections import deque
 from enum import IntEnum
 from PIL import Image, ImageDraw, ImageFont, ImageTk
+import numpy as np
 
 import openai
+import httpx    # installed along with openai
 S2P_VERSION = "1.1"
 
 g_isMacOS = False
@@ -169,28 +185,258 @@ else:
 # import platform specific libraries
 if g_isMacOS:
     import sounddevice
-    import soundfile
 
 else:
     # --------- import for Raspberry Pi -----------------------------------------
     import pyaudio
-    import wave
     from ctypes import *
-    import RPi.GPIO as GPIO
-    import threading
-    from queue import Queue
+    try:
+        import RPi.GPIO as GPIO
+    except (ImportError, RuntimeError):
+        # not on a Raspberry Pi, SimulatedGPIO below stands in for the pins
+        GPIO = None
+
+# optional, used to compress recordings to FLAC before they are uploaded
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+
+class SimulatedGPIO:
+    '''
+    Stand in for RPi.GPIO so the button modes can be tried without a Raspberry Pi.
+    Used when RPi.GPIO can't be imported or the environment variable S2P_SIMULATE_GPIO is set.
+    Pressing Enter in the terminal presses an input pin, pressing Enter again releases it;
+    code can also call press(pin) and release(pin) directly.
+    '''
+
+    BOARD = "BOARD"
+    BCM = "BCM"
+    IN = "IN"
+    OUT = "OUT"
+    LOW = 0
+    HIGH = 1
+    PUD_UP = "PUD_UP"
+    PUD_DOWN = "PUD_DOWN"
+
+    def __init__(self):
+        self.pins = {}
+        self.pressedLevel = {}
+        self.isKeyboardButton = sys.stdin.isatty()
+
+    def setmode(self, mode):
+        print("Simulated GPIO: press Enter to press the button, Enter again to release it")
+
+    def setup(self, pin, direction, initial=LOW, pull_up_down=None):
+        if direction == self.IN:
+            # a pulled up button reads LOW while pressed
+            self.pressedLevel[pin] = self.LOW if pull_up_down == self.PUD_UP else self.HIGH
+            self.pins[pin] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+        else:
+            self.pins[pin] = initial
+
+    def output(self, pin, level):
+        self.pins[pin] = level
+
+    def input(self, pin):
+        if self.isKeyboardButton and select.select([sys.stdin], [], [], 0)[0]:
+            sys.stdin.readline()
+            if self.pins[pin] == self.pressedLevel[pin]:
+                self.release(pin)
+            else:
+                self.press(pin)
+        return self.pins[pin]
+
+    def press(self, pin):
+        self.pins[pin] = self.pressedLevel[pin]
+
+    def release(self, pin):
+        self.pins[pin] = self.HIGH - self.pressedLevel[pin]
 
+    def cleanup(self):
+        pass
+
+if not g_isMacOS and (GPIO is None or os.environ.get("S2P_SIMULATE_GPIO")):
+    GPIO = SimulatedGPIO()
 
 
 # Global constants
 LOOPS_MAX = 10 # Set the number of times to loop when in auto mode
 
+# Audio capture format: 16 bit mono, read from the microphone one block at a time
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_FRAMES_PER_BLOCK = 1024
+AUDIO_MAX_REOPENS = 3           # times the microphone is reopened in one recording before giving up
+AUDIO_STOP_TIMEOUT = 1.0        # seconds to wait for a recording that ran out of time to let go of the microphone
+
+# Voice activity detection, used to end a short recording once the speaker stops talking.
+# A block counts as speech when it is loud enough and its zero crossing rate looks like a voice
+# rather than hum (too few crossings) or hiss (too many).
+VAD_ENERGY_THRESHOLD = 400      # minimum RMS (16 bit scale) for a block to be speech
+VAD_NOISE_FACTOR = 3.0          # speech must also be this many times louder than the noise floor
+VAD_ZCR_MIN = 0.005             # zero crossings per sample
+VAD_ZCR_MAX = 0.30
+VAD_TRAILING_SILENCE = 1.2      # seconds of silence after speech that ends the recording
+VAD_MIN_DURATION = 2.0          # never end a recording before this many seconds
+VAD_NO_SPEECH_TIMEOUT = 6.0     # give up if nobody has started talking after this many seconds
+VAD_PRE_ROLL = 0.5              # seconds of audio kept from just before speech started
+
+# Silence gate: a recording with less speech than this is not sent for transcription or pictures.
+# Blocks count as speech using the VAD_ loudness and zero crossing limits above.
+SILENCE_GATE_MIN_SPEECH = 0.3   # seconds of speech needed, can be changed with --silencegate
+SILENCE_GATE_MIN_PEAK = 1000    # a recording that never gets louder than this is empty whatever else
+NO_SPEECH_MESSAGE = "I didn't hear anything.\n\rPlease try again."
+
+# How often the windows are refreshed while the async pipeline waits
+TK_UPDATE_INTERVAL = 0.05
+
+# In auto mode the microphone records continuously; this many finished segments can wait to be processed
+CAPTURE_QUEUE_MAX = 2
+
+# Long recordings are transcribed in overlapping chunks while they are still being recorded
+TRANSCRIBE_CHUNK_SECONDS = 30
+TRANSCRIBE_CHUNK_OVERLAP = 2    # seconds each chunk shares with the one before it
+TRANSCRIBE_OVERLAP_MAX_WORDS = 12
+TRANSCRIBE_WORKERS = 2
+
+# Shared HTTP connection pool
+HTTP_TIMEOUT = 120              # seconds; OpenAI calls use their own longer timeout
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_MAX_CONNECTIONS = 10
+HTTP_KEEPALIVE_SECONDS = 90     # keep idle connections long enough to last through a recording
+OPENAI_API_URL = "https://api.openai.com/v1/"
+IMAGE_HOST_URL = "https://oaidalleapiprodscus.blob.core.windows.net/"   # where generated images are served from
+
+# The generated images are downloaded at the same time, each with its own timeout and retries
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_TIMEOUT = 15           # seconds for one image
+DOWNLOAD_ATTEMPTS = 3
+DOWNLOAD_RETRY_DELAY = 0.5      # seconds, longer after each failure
+DOWNLOAD_MAX_BYTES = 8 * 1024 * 1024    # a 512x512 PNG is well under 1 MB
+IMAGE_MAX_PIXELS = 4096 * 4096  # refuse to decode anything bigger
+
+# Image generation retries transient errors with jittered exponential backoff, and can send a second
+# (hedged) request when the first is slower than IMAGE_HEDGE_PERCENTILE of recent requests
+IMAGE_RETRY_ATTEMPTS = 3
+IMAGE_RETRY_BASE_DELAY = 1.0    # seconds, doubled for each retry
+IMAGE_RETRY_MAX_DELAY = 8.0
+IMAGE_HEDGE_PERCENTILE = 90
+IMAGE_HEDGE_MIN_SAMPLES = 5     # don't hedge until we know what a normal request takes
+IMAGE_LATENCY_HISTORY = 50
+
+# Each pipeline stage gets a deadline in seconds, so a hung request can't keep a visitor waiting forever
+# (capture gets this much on top of the recording length)
+STAGE_DEADLINES = {
+    "capture": 5,
+    "transcribe": 30,
+    "keywords": 20,
+    "image": 60,
+    "download": 20,
+    "composite": 10,
+    "display": 5,
+}
+DEADLINE_MESSAGE = "Sorry, that took too long.\n\rPlease try again."
+DEADLINE_FALLBACK_WORDS = 60    # when keywords run out of time, the start of the transcript is used instead
+
+# Speculative images are started from a rough cut of the transcript while the keywords are extracted.
+# They are kept if the keywords turn out to be mostly about the same things
+SPECULATION_KEEP_OVERLAP = 0.5  # share of the keywords' words that the rough cut must also have
+
+# Rough cost in dollars of each kind of OpenAI call, for the daily spend budget
+API_CALL_COSTS = {
+    "Transcribe": 0.0001,       # per second of audio sent
+    "Summary": 0.001,
+    "Rolling summary": 0.0005,
+    "Keywords": 0.0005,
+    "Image": 0.018,             # per image, set from IMAGE_COSTS_BY_SIZE for the tile size in use
+}
+IMAGE_COSTS_BY_SIZE = {256: 0.016, 512: 0.018, 1024: 0.020}
+UNKNOWN_AUDIO_SECONDS = 60      # charged for a recording whose length can't be read
+
+# OpenAI calls are held to these rates (shared by every call this kiosk makes), and stop once the
+# day's estimated spend reaches the budget
+RATE_LIMIT_REQUESTS_PER_MINUTE = 50
+RATE_LIMIT_IMAGES_PER_MINUTE = 20
+DAILY_SPEND_BUDGET = 10.0       # dollars, 0 for no budget
+SPEND_FILE = "s2pspend.json"    # today's spend, kept across restarts
+RATE_LIMIT_NOTICE_SECONDS = 2   # tell the visitor if they will wait longer than this for their turn
+BUDGET_MESSAGE = "That's all the pictures for today.\n\rPlease come back tomorrow!"
+
+# The combined picture: by default four 512 pixel tiles in a 2x2 grid, with a caption bar under them.
+# Fewer or smaller tiles are quicker to make and to put together, for slower Pis and smaller screens
+IMAGES_PER_REQUEST = 4
+COMPOSITE_TILE_SIZE = 512           # one of the sizes OpenAI makes: 256, 512 or 1024
+COMPOSITE_GRIDS = {1: (1, 1), 2: (2, 1), 3: (3, 1), 4: (2, 2)}  # (columns, rows) for each number of tiles
+COMPOSITE_CAPTION_HEIGHT = 50       # these three are for tiles shown at 512 pixels, and scale with them
+COMPOSITE_CAPTION_FONT_SIZE = 18
+COMPOSITE_ERROR_FONT_SIZE = 24
+COMPOSITE_CAPTION_MIN_FONT_SIZE = 12    # the caption shrinks down to this to fit, then is cut short
+COMPOSITE_MIN_CELL_SIZE = 64        # smallest a tile can be shown at, in pixels
+COMPOSITE_FONT = "arial.ttf"
+
+# Pictures already made are reused for keywords that are close enough to the ones they were made for
+IMAGE_CACHE_MATCH_THRESHOLD = 0.8   # 0 to 1, how alike the keywords must be (IDF weighted word overlap)
+IMAGE_CACHE_MAX_ENTRIES = 1000
+IMAGE_CACHE_MAX_AGE = 30 * 24 * 60 * 60   # seconds before a picture is too old to reuse
+IMAGE_CACHE_MAX_REUSES = 5          # after this, a new picture is made for the same keywords
+IMAGE_CACHE_REPEAT_GAP = 10 * 60    # seconds before the same picture is shown again
+IMAGE_CACHE_REFRESH_CHANCE = 0.2    # chance of making a new picture anyway, so popular prompts get variety
+
+# Cassettes hold recorded OpenAI results and image downloads, to replay runs without the network
+CASSETTE_DIR = "cassettes"
+
+# Results from OpenAI are remembered on disk so replays of the same input cost nothing
+CACHE_DIR = "cache"
+TRANSCRIPT_CACHE_MAX_ENTRIES = 500
+LLM_CACHE_MAX_ENTRIES = 1000
+LLM_CACHE_MAX_AGE = 7 * 24 * 60 * 60   # seconds before a keyword or summary result is asked for again
+
+# Recordings are resampled to this rate before upload; it is all the transcription model uses
+UPLOAD_SAMPLE_RATE = 16000
+RESAMPLE_FILTER_TAPS = 31       # length of the anti-aliasing filter used when resampling
+
+TRANSCRIBE_MODEL = "whisper-1"
+CHAT_MODEL = "gpt-4o-mini"
+
+PROMPT_FOR_SUMMARY = "Please summarize the following text:\n"
+
+# In auto mode a running summary of the conversation is kept, and each new segment is folded into it
+PROMPT_FOR_ROLLING_SUMMARY = "Here is a summary of a conversation so far, followed by what was said next. \
+    Rewrite the summary to include what was said next, in {maxWords} words or less. \
+    Keep the topics people keep coming back to and drop the small talk. Reply with only the summary.\n"
+ROLLING_SUMMARY_MAX_WORDS = 120     # keeps the prompt the same size however long the conversation runs
+ROLLING_SUMMARY_IDLE_RESET = 10 * 60   # seconds without a new segment before a new conversation is started
+
 # Prompt for abstraction
 # PROMPT_FOR_ABSTRACTION = "What is the most interesting concept in the following text \
 #   expressing the answer as a noun phrase, but not in a full sentence "
 PROMPT_FOR_ABSTRACTION = "In 15 words or less, what are the most interesting concepts in the following text \
     expressing the answer as a noun phrase, but not in a full sentence "
 
+# Keywords can also be extracted locally, without a round trip to the chat model
+LOCAL_KEYWORDS_MAX_WORDS = 15       # same limit the chat model is given
+LOCAL_KEYWORDS_MAX_PHRASE_WORDS = 3
+LOCAL_KEYWORDS_MAX_TRANSCRIPT_WORDS = 150   # in auto backend mode, longer transcripts still go to the chat model
+KEYWORD_STOPWORDS = frozenset('''
+    a about above actually after again against all also am an and any anyone anything are aren't as
+    at back basically be because been before being bit below between both but by came can can't
+    cannot come could couldn't did didn't do does doesn't doing don't down during each either else
+    even ever every everyone everything few for from further get gets getting go goes going gonna
+    got gotta had hadn't has hasn't have haven't having he he'd he'll he's her here here's hers
+    herself him himself his how how's however i i'd i'll i'm i've if in into is isn't it it's its
+    itself just kind know last let let's like lot lots made make many may maybe me mean might more
+    most much must mustn't my myself need never no nor not nothing now of off oh okay ok on once one
+    only or other ought our ours ourselves out over own pretty probably quite rather really right
+    said same saw say says see seen shall shan't she she'd she'll she's should shouldn't so some
+    someone something sort still stuff such sure take tell than that that's the their theirs them
+    themselves then there there's these they they'd they'll they're they've thing things think this
+    those though through to today tomorrow too uh um under until up upon us use very want wanna was
+    wasn't way we we'd we'll we're we've well went were weren't what what's when when's where
+    where's whether which while who who's whom why why's will with won't would wouldn't yeah yes
+    yesterday yet you you'd you'll you're you've your yours yourself yourselves
+    '''.split())
+
 # image prompt modifiers
 # 'generate a picture [MODIFIER] for the following concept: ...'
 
@@ -240,6 +486,10 @@ if not g_isMacOS:
     BUTTON_GO = 10
     BUTTON_PULL_UP_DOWN = GPIO.PUD_UP
     BUTTON_PRESSED = GPIO.LOW  
+    BUTTON_DEBOUNCE = 0.08  # seconds the button must stay released before we believe it
+
+# Longest recording when the visitor holds the button down while speaking
+HOLD_TO_TALK_MAX = 20
 
 # used by command line args to jump into the middle of the process
 class processStep(IntEnum):
@@ -286,6 +536,80 @@ class g_args:
     # if true, then save files that are generated in the process - mostly a debug feature
     isSaveFiles = False
 
+    # if true, short keyword recordings end when the speaker stops talking rather than
+    # always running for the full duration
+    isEndOnSilence = True
+
+    # if true, auto mode records continuously on a background thread instead of pausing while processing
+    isContinuousCapture = True
+
+    # seconds of speech a recording needs before it is transcribed, 0 turns the silence gate off
+    silenceGateSeconds = SILENCE_GATE_MIN_SPEECH
+
+    # if true, long recordings are transcribed in chunks while they are recorded
+    isChunkedTranscription = True
+
+    # if true, with hardware buttons the visitor holds the button while speaking and recording
+    # ends when it is released
+    isHoldToTalk = False
+
+    # if false, don't look up or store results in the on-disk caches
+    isUsingCache = True
+
+    # if true, a second image request is sent when the first one is unusually slow
+    isHedgingImages = False
+
+    # if true, auto mode keeps a running summary of the conversation for the keywords to draw on
+    isRollingSummary = True
+
+    # if true, long transcripts start the image request before the keywords are back
+    isSpeculativeImages = False
+
+    # where keywords come from: "llm" asks the chat model, "local" extracts them here,
+    # "auto" extracts them here unless the transcript is long
+    keywordBackend = "llm"
+
+    # how images come back from OpenAI: "url" to download them afterwards, "b64_json" inline in the response
+    imageResponseFormat = "url"
+
+    # if not 0, time this many image requests with each response format, then exit
+    benchmarkImageCount = 0
+
+    # if set, compare the local keywords with the chat model's keywords logged in this file, then exit
+    compareKeywordsLog = None
+
+    # how alike keywords must be to reuse a picture made before, 0 to 1
+    imageCacheMatch = IMAGE_CACHE_MATCH_THRESHOLD
+
+    # "record" saves every OpenAI result and image download to the cassette named cassetteName,
+    # "replay" plays them back from it instead of using the network
+    cassetteMode = None
+    cassetteName = None
+
+    # if false, replays return at once instead of taking as long as the recorded calls did
+    isReplayDelayed = True
+
+    # limits on the OpenAI calls this kiosk makes, and on what it spends a day (0 for no budget)
+    requestsPerMinute = RATE_LIMIT_REQUESTS_PER_MINUTE
+    imagesPerMinute = RATE_LIMIT_IMAGES_PER_MINUTE
+    dailyBudget = DAILY_SPEND_BUDGET
+
+    # if false, the pipeline stages have no deadlines
+    isUsingDeadlines = True
+
+    # if true, live recordings go through audioToPictureAsync
+    isAsyncPipeline = False
+
+    # the layout of the picture: how many images, in what grid (columns, rows; None for the usual one),
+    # the size they are made at, and the width of the finished picture (0 for the images at full size)
+    tileCount = IMAGES_PER_REQUEST
+    tileGrid = None
+    tileSize = COMPOSITE_TILE_SIZE
+    outputWidth = 0
+
+    # how recordings are encoded for upload: "flac", "wav" (both at UPLOAD_SAMPLE_RATE) or "original"
+    uploadFormat = "flac"
+
 
 
 # global window variables
@@ -301,8 +625,54 @@ class globalWindowVars:
 
 gw = globalWindowVars()
 
-# XXX client = OpenAI()  # must have set up your key in the shell as noted in comments above
-client = openai
+class HttpStats:
+    '''
+    Count the requests and the new connections made through the shared HTTP clients, so we can see
+    how often a pooled keep-alive connection was reused. New connections are counted with the
+    httpcore trace extension, which the request hook adds to every request.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.newConnections = 0
+
+    def onRequest(self, request):
+        with self.lock:
+            self.requests += 1
+        request.extensions["trace"] = self.trace
+
+    def trace(self, eventName, info):
+        if eventName == "connection.connect_tcp.complete":
+            with self.lock:
+                self.newConnections += 1
+
+    def stats(self):
+        '''return a one line summary of connection reuse'''
+        return (f"HTTP: {self.requests} requests, {self.newConnections} new connections, "
+                f"{self.requests - self.newConnections} reused")
+
+httpStats = HttpStats()
+
+# One HTTP client with a keep-alive connection pool is shared by the OpenAI calls and the image
+# downloads, so a visitor's requests reuse connections rather than each doing a TCP and TLS handshake
+httpClient = httpx.Client(
+    timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, keepalive_expiry=HTTP_KEEPALIVE_SECONDS),
+    event_hooks={"request": [httpStats.onRequest]})
+
+try:
+    client = openai.OpenAI(http_client=httpClient)  # must have set up your key in the shell as noted in comments above
+except openai.OpenAIError as e:
+    # no API key; still fine for showing an image file, any OpenAI call will report the problem
+    print(e)
+    client = openai
+
+# the image host most recently downloaded from, connections to it are opened early too
+imageHostURL = IMAGE_HOST_URL
+
+# the event loop the async pipeline (--async) runs on, created when first needed
+asyncLoop = None
 
 # set up logging
 logger = logging.getLogger(__name__) # parameter: -d 1
@@ -430,7 +800,16 @@ def showStatus(labelForStatusDisplay = None):
 
     msg =("Status:\n\n" + ipMsg + "\n" + historyCount + "\n" 
         + oldestFileDate + "\n" + idleFileCount + "\n" 
-        + "Free Space: " + freeSpace )
+        + "Free Space: " + freeSpace + "\n"
+        + transcriptCache.stats() + "\n"
+        + llmCache.stats() + "\n"
+        + imageCache.stats() + "\n"
+        + httpStats.stats() + "\n"
+        + imagePolicy.stats() + "\n"
+        + stageDeadlines.stats() + "\n"
+        + imageSpeculation.stats() + "\n"
+        + rateLimiter.stats() + "\n"
+        + audioEngine.stats() )
 
     display_text_in_status_window(msg, labelForStatusDisplay)
     # sleep for 10 seconds
@@ -467,309 +846,2372 @@ def changeBlinkRate(blinkRate):
         pass
 
 
-def recordAudioFromMicrophone(duration):
-    '''record duration seconds of audio from the default microphone to a file and return the sound file name'''
+def makeButtonReleasedCheck():
+    '''
+    return a function that returns True once the GO button has been released. The button must
+    stay up for BUTTON_DEBOUNCE seconds so contact bounce doesn't end a recording early.
+    '''
+
+    releasedTime = None
+
+    def isButtonReleased():
+        nonlocal releasedTime
+        if GPIO.input(BUTTON_GO) == BUTTON_PRESSED:
+            releasedTime = None
+            return False
+        if releasedTime is None:
+            releasedTime = time.time()
+        return time.time() - releasedTime >= BUTTON_DEBOUNCE
+
+    return isButtonReleased
+
+
+def analyzeAudioBlock(block):
+    '''return the (rms, zero crossing rate) of a block of 16 bit mono samples'''
+
+    samples = np.frombuffer(block, dtype=np.int16).astype(np.float32)
+    if samples.size < 2:
+        return 0.0, 0.0
+
+    rms = float(np.sqrt(np.mean(samples * samples)))
+    zeroCrossings = np.count_nonzero(np.signbit(samples[1:]) != np.signbit(samples[:-1]))
+    zcr = zeroCrossings / (samples.size - 1)
+
+    return rms, zcr
+
+
+class VoiceActivityDetector:
+    '''
+    Classify each block of a recording as speech or silence and decide when the speaker is done.
+    A ring buffer holds the verdicts for the last VAD_TRAILING_SILENCE seconds; once speech has
+    been heard and every block in the ring is silence, the recording is over.
+    '''
+
+    def __init__(self, sampleRate=AUDIO_SAMPLE_RATE, framesPerBlock=AUDIO_FRAMES_PER_BLOCK):
+        self.blockSeconds = framesPerBlock / sampleRate
+        self.recentBlocks = deque(maxlen=max(1, round(VAD_TRAILING_SILENCE / self.blockSeconds)))
+        self.noiseFloor = None
+        self.heardSpeech = False
+        self.elapsed = 0.0
+
+    def isSpeech(self, block):
+        '''return True if the block sounds like someone talking; tracks the noise floor'''
+        rms, zcr = analyzeAudioBlock(block)
+
+        threshold = VAD_ENERGY_THRESHOLD
+        if self.noiseFloor is not None:
+            threshold = max(threshold, self.noiseFloor * VAD_NOISE_FACTOR)
+
+        speech = rms > threshold and VAD_ZCR_MIN <= zcr <= VAD_ZCR_MAX
+
+        if not speech:
+            # slowly follow the background noise so a noisy room doesn't look like speech
+            if self.noiseFloor is None:
+                self.noiseFloor = rms
+            else:
+                self.noiseFloor = 0.95 * self.noiseFloor + 0.05 * rms
+
+        return speech
+
+    def addBlock(self, block):
+        '''add the next block of the recording; return True when the recording should end'''
+        self.elapsed += self.blockSeconds
+        speech = self.isSpeech(block)
+        self.recentBlocks.append(speech)
+        if speech:
+            self.heardSpeech = True
+
+        if not self.heardSpeech:
+            return self.elapsed >= VAD_NO_SPEECH_TIMEOUT
+
+        if self.elapsed < VAD_MIN_DURATION:
+            return False
+
+        return len(self.recentBlocks) == self.recentBlocks.maxlen and not any(self.recentBlocks)
+
+
+def captureAudioBlocks(readBlock, duration, sampleRate, endOnSilence, onBlock=None, shouldStop=None):
+    '''
+    call readBlock() until duration seconds have been read and return the list of blocks.
+    When endOnSilence is True, stop as soon as the speaker has finished and drop any
+    silence at the start other than a short pre roll.
+    If onBlock is given, every block is also passed to it as soon as it is read.
+    If shouldStop is given, the recording ends as soon as shouldStop() returns True.
+    '''
+
+    maxBlocks = max(1, int(duration * sampleRate / AUDIO_FRAMES_PER_BLOCK))
+
+    if onBlock is not None:
+        readFromMicrophone = readBlock
+        def readBlock():
+            block = readFromMicrophone()
+            onBlock(block)
+            return block
+
+    if not endOnSilence:
+        frames = []
+        for i in range(maxBlocks):
+            if shouldStop is not None and shouldStop():
+                break
+            frames.append(readBlock())
+        return frames
+
+    vad = VoiceActivityDetector(sampleRate)
+    preRoll = deque(maxlen=max(1, round(VAD_PRE_ROLL / vad.blockSeconds)))
+    frames = []
+
+    for i in range(maxBlocks):
+        if shouldStop is not None and shouldStop():
+            break
+        block = readBlock()
+        isDone = vad.addBlock(block)
+
+        if vad.heardSpeech:
+            # keep a little of what came just before the speech so the first word isn't clipped
+            frames.extend(preRoll)
+            preRoll.clear()
+            frames.append(block)
+        else:
+            preRoll.append(block)
+
+        if isDone:
+            break
+
+    logger.info("Recorded %.1f of %d seconds, speech heard: %s", vad.elapsed, duration, vad.heardSpeech)
+
+    if not frames:
+        frames = list(preRoll)
+
+    return frames
+
+
+class AudioEngine:
+    '''
+    Owns the microphone for the life of the program. The audio library and the input stream
+    are set up once by open() and then only started and stopped around each recording, which
+    saves the stream setup time on every button press. If the device goes away (unplugged USB
+    microphone, ALSA hiccup) the stream is reopened and the recording carries on from the block
+    it was reading, so whatever is watching the blocks as they come never sees one twice. After
+    AUDIO_MAX_REOPENS in one recording the device is taken to be gone and the error is raised.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stream = None
+        self.pa = None
+        self.sampleRate = AUDIO_SAMPLE_RATE
+        self.reopenCount = 0
+        self.streamReopens = 0      # reopens during the current recording
+
+    def open(self):
+        '''initialize the audio library and open the input stream, ready for a recording'''
+
+        if self.stream is not None:
+            return
+
+        if g_isMacOS:
+            # print the devices
+            # print(sounddevice.query_devices())  # in case you have trouble with the devices
+            self.sampleRate = int(sounddevice.query_devices(1)['default_samplerate'])
+            self.stream = sounddevice.InputStream(
+                samplerate=self.sampleRate, 
+                channels=1,
+                dtype='int16',
+                blocksize=AUDIO_FRAMES_PER_BLOCK
+                )
+
+        else:
+            # all this crap because the ALSA library can't police itself
+            ERROR_HANDLER_FUNC = CFUNCTYPE(None, c_char_p, c_int, c_char_p, c_int, c_char_p)
+            def py_error_handler(filename, line, function, err, fmt):
+                pass #nothing to see here
+            c_error_handler = ERROR_HANDLER_FUNC(py_error_handler)
+            asound = cdll.LoadLibrary('libasound.so')
+            # Set error handler
+            asound.snd_lib_error_set_handler(c_error_handler)
+            # Initialize PyAudio
+            self.pa = pyaudio.PyAudio()
+            # Reset to default error handler
+            asound.snd_lib_error_set_handler(None)
+            # now on with the show, sheesh
+
+            self.sampleRate = AUDIO_SAMPLE_RATE
+            self.stream = self.pa.open(
+                format=pyaudio.paInt16,
+                channels=1,
+                rate=self.sampleRate,
+                input=True,
+                frames_per_buffer=AUDIO_FRAMES_PER_BLOCK,
+                start=False
+                ) #,input_device_index=2)
+
+        logger.info("Audio engine opened, sample rate %d", self.sampleRate)
+
+    def close(self):
+        '''close the input stream and release the audio library'''
+
+        try:
+            if self.stream is not None:
+                self.stream.close()
+            if self.pa is not None:
+                self.pa.terminate()
+        except Exception as e:
+            logger.warning("Error closing audio engine: " + str(e))
+
+        self.stream = None
+        self.pa = None
+
+    def start(self):
+        '''open the stream if it isn't already, and start it'''
+        self.open()
+        if g_isMacOS:
+            self.stream.start()
+        else:
+            self.stream.start_stream()
+
+    def reopen(self, e):
+        '''throw the stream out after error e and start a new one, raising e once there have been too many'''
+        while True:
+            logger.error("Audio device error: " + str(e))
+            self.close()
+            if self.streamReopens >= AUDIO_MAX_REOPENS:
+                logToFile.error("Audio device error, giving up after %d reopens: %s", self.streamReopens, str(e))
+                raise e
+
+            logToFile.error("Audio device error, reopening: " + str(e))
+            self.streamReopens += 1
+            self.reopenCount += 1
+            try:
+                self.start()
+                return
+            except Exception as startError:
+                e = startError
+
+    def readFromStream(self):
+        if g_isMacOS:
+            return self.stream.read(AUDIO_FRAMES_PER_BLOCK)[0].tobytes()
+        else:
+            return self.stream.read(AUDIO_FRAMES_PER_BLOCK, exception_on_overflow=False)
+
+    def readBlock(self):
+        '''
+        return the next block of 16 bit samples from the microphone as bytes.
+        if the read fails the stream is reopened and the block read again, so the recording
+        carries on rather than starting over
+        '''
+        while True:
+            try:
+                return self.readFromStream()
+            except Exception as e:
+                # most likely the device went away
+                self.reopen(e)
+
+    def runStream(self, readLoop):
+        '''start the stream, call readLoop() to read from it, stop the stream and return what readLoop returned'''
+
+        with self.lock:
+            self.streamReopens = 0
+            try:
+                self.start()
+            except Exception as e:
+                self.reopen(e)
+
+            try:
+                result = readLoop()
+            except Exception:
+                # the device is gone for good; the next recording starts with a new stream
+                self.close()
+                raise
+
+            try:
+                if g_isMacOS:
+                    self.stream.stop()
+                else:
+                    self.stream.stop_stream()
+            except Exception as e:
+                logger.warning("Error stopping the audio stream: " + str(e))
+                self.close()
+
+            return result
+
+    def record(self, duration, endOnSilence=False, onBlock=None, shouldStop=None):
+        '''record up to duration seconds and return the list of sample blocks'''
+
+        # a recording that runs past its stage deadline stops, so the microphone is free for the next one
+        def isStopping():
+            return stageDeadlines.isStopping() or (shouldStop is not None and shouldStop())
+
+        return self.runStream(lambda: captureAudioBlocks(self.readBlock, duration, self.sampleRate, endOnSilence,
+                                                         onBlock, isStopping))
+
+    def waitUntilStopped(self, timeout=AUDIO_STOP_TIMEOUT):
+        '''wait for a recording that has been told to stop to let go of the microphone'''
+        if self.lock.acquire(timeout=timeout):
+            self.lock.release()
+        else:
+            logToFile.warning("Recording still running %g seconds after being told to stop", timeout)
+
+    def stats(self):
+        return f"Microphone reopened {self.reopenCount} times"
+
+    def listen(self, onBlock, shouldStop):
+        '''read blocks without a break, handing each one to onBlock, until shouldStop() returns True'''
+
+        def readLoop():
+            while not shouldStop():
+                onBlock(self.readBlock())
+
+        self.runStream(readLoop)
+
+audioEngine = AudioEngine()
+
+
+def makeWavBuffer(frames, sampleRate, name="recording.wav"):
+    '''pack blocks of 16 bit mono samples into an in-memory WAV file and return it'''
+
+    wavBuffer = io.BytesIO()
+    wf = wave.open(wavBuffer,"wb")
+    wf.setnchannels(1)
+    wf.setsampwidth(2)  # 16 bit samples
+    wf.setframerate(sampleRate)
+    wf.writeframes(b''.join(frames))
+    wf.close()
+
+    wavBuffer.name = name  # the upload uses the name to tell the audio format
+    wavBuffer.seek(0)
+    return wavBuffer
+
+
+def saveFileInBackground(fileName, data):
+    '''
+    write data (bytes or text) to fileName on a separate thread so that slow SD card
+    writes stay off the path between the button press and the picture
+    '''
+
+    def writeFile():
+        try:
+            with open(fileName, "wb" if isinstance(data, bytes) else "w") as f:
+                f.write(data)
+        except Exception as e:
+            logger.error("Error saving file " + fileName + ": " + str(e))
+            logToFile.error("Error saving file " + fileName + ": " + str(e))
+
+    threading.Thread(target=writeFile).start()
+
+
+class BackgroundFileWriter:
+    '''
+    Writes a file that changes often, like an index, on a separate thread so the SD card write stays
+    off the visitor's path. Each version is written to a temporary file and renamed over the old one,
+    so losing power part way through never leaves half a file, and an older version that is slow
+    to write never replaces a newer one.
+    '''
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.writeLock = threading.Lock()
+        self.version = 0
+        self.savedVersion = 0
+
+    def save(self, text):
+        '''write text to the file in the background'''
+        with self.lock:
+            self.version += 1
+            version = self.version
+        threading.Thread(target=self.write, args=(version, text)).start()
+
+    def write(self, version, text):
+        with self.writeLock:
+            if version <= self.savedVersion:
+                # a newer version is already written
+                return
+            try:
+                directory = os.path.dirname(self.fileName)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.fileName + ".tmp", "w") as f:
+                    f.write(text)
+                os.replace(self.fileName + ".tmp", self.fileName)
+                self.savedVersion = version
+            except OSError as e:
+                logger.warning("Could not write " + self.fileName + ": " + str(e))
+
+
+def recordAudioFromMicrophone(duration, endOnSilence=False, onBlock=None, shouldStop=None):
+    '''
+    record up to duration seconds of audio from the default microphone and return it as an in-memory WAV file
+    if endOnSilence is True, the recording ends once the speaker stops talking
+    if onBlock is given, it is called with each block of samples while recording
+    if shouldStop is given, the recording ends as soon as shouldStop() returns True
+    '''
+
+    logger.info("Recording %d seconds...", duration)
+    frames = audioEngine.record(duration, endOnSilence, onBlock, shouldStop)
+
+    return makeWavBuffer(frames, audioEngine.sampleRate)
+
+
+class ContinuousCapture:
+    '''
+    Record back to back segments on a background thread for auto mode, so the microphone keeps
+    listening while earlier segments are being transcribed and turned into pictures. Finished
+    segments wait in a small queue: one being processed and one recording gives double buffering.
+    If processing falls behind and the queue is full, the oldest waiting segment is thrown away so
+    the picture always follows the most recent part of the conversation.
+    If makeTranscriber is given, it is called at the start of each segment and the ChunkedTranscriber
+    it returns (or None) is fed the segment while it records.
+    '''
+
+    def __init__(self, segmentDuration, makeTranscriber=None, maxWaiting=CAPTURE_QUEUE_MAX):
+        self.segmentDuration = segmentDuration
+        self.makeTranscriber = makeTranscriber
+        self.segments = Queue(maxsize=maxWaiting)
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.blocks = []
+        self.transcriber = None
+        self.droppedCount = 0
+
+    def start(self):
+        '''start recording on a background thread'''
+        logger.info("Starting continuous capture of %d second segments", self.segmentDuration)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''stop recording and wait for the background thread to finish'''
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+
+        # nobody is going to use the unfinished transcripts
+        if self.transcriber is not None:
+            self.transcriber.cancel()
+        while True:
+            item = self.getSegment(timeout=0)
+            if item is None:
+                break
+            if item[1] is not None:
+                item[1].cancel()
+
+        logToFile.info("Continuous capture stopped, %d segments dropped", self.droppedCount)
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            try:
+                audioEngine.listen(self.addBlock, self.stopEvent.is_set)
+            except Exception as e:
+                logger.error("Continuous capture error: " + str(e))
+                logToFile.error("Continuous capture error: " + str(e))
+                self.stopEvent.wait(1)
+
+    def addBlock(self, block):
+        '''collect blocks from the microphone and queue a segment each time one is full'''
+        if not self.blocks and self.makeTranscriber is not None:
+            self.transcriber = self.makeTranscriber()
+        if self.transcriber is not None:
+            self.transcriber.addBlock(block)
+
+        self.blocks.append(block)
+        if len(self.blocks) * AUDIO_FRAMES_PER_BLOCK >= self.segmentDuration * audioEngine.sampleRate:
+            segment = makeWavBuffer(self.blocks, audioEngine.sampleRate)
+            self.putSegment((segment, self.transcriber))
+            self.blocks = []
+            self.transcriber = None
+
+    def putSegment(self, item):
+        while True:
+            try:
+                self.segments.put_nowait(item)
+                return
+            except queue.Full:
+                # processing has fallen behind, make room by dropping the oldest segment
+                try:
+                    dropped = self.segments.get_nowait()
+                    if dropped[1] is not None:
+                        dropped[1].cancel()
+                    self.droppedCount += 1
+                    logger.info("Continuous capture dropped a segment, %d so far", self.droppedCount)
+                except queue.Empty:
+                    pass
+
+    def getSegment(self, timeout=None):
+        '''
+        return (audio, transcriber) for the next finished segment, where audio is an in-memory WAV file
+        and transcriber is its ChunkedTranscriber or None; return None after timeout seconds
+        '''
+        try:
+            return self.segments.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def readWavSamples(audio):
+    '''
+    return (samples, sampleRate) for a 16 bit WAV file name or in-memory WAV file;
+    multi channel recordings are mixed down to mono
+    '''
+
+    if not isinstance(audio, str):
+        audio.seek(0)
+    wf = wave.open(audio, "rb")
+    try:
+        if wf.getsampwidth() != 2:
+            raise wave.Error("only 16 bit audio is supported")
+        sampleRate = wf.getframerate()
+        channels = wf.getnchannels()
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    finally:
+        wf.close()
+        if not isinstance(audio, str):
+            audio.seek(0)
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+
+    return samples, sampleRate
+
+
+def analyzeSpeechPresence(audio, minSpeechSeconds=SILENCE_GATE_MIN_SPEECH):
+    '''
+    measure how loud a recording is and how much of it sounds like speech.
+    isSpeech is True when it has at least minSpeechSeconds of speech and isn't almost silent.
+    Returns a dict with duration, rms, peak, speechSeconds and isSpeech, or None if the audio
+    can't be read (not a 16 bit WAV file) and so should be assumed to contain speech.
+    '''
+
+    try:
+        samples, sampleRate = readWavSamples(audio)
+    except (wave.Error, EOFError) as e:
+        logger.info("Can't analyze audio: " + str(e))
+        return None
+
+    numBlocks = samples.size // AUDIO_FRAMES_PER_BLOCK
+    if numBlocks == 0:
+        return {"duration": samples.size / sampleRate, "rms": 0.0, "peak": 0, "speechSeconds": 0.0, "isSpeech": False}
+
+    # one row per block, all blocks measured at once
+    blocks = samples[:numBlocks * AUDIO_FRAMES_PER_BLOCK].reshape(numBlocks, AUDIO_FRAMES_PER_BLOCK).astype(np.float32)
+    blockRms = np.sqrt(np.mean(blocks * blocks, axis=1))
+    signs = np.signbit(blocks)
+    blockZcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (AUDIO_FRAMES_PER_BLOCK - 1)
+
+    isSpeechBlock = (blockRms > VAD_ENERGY_THRESHOLD) & (blockZcr >= VAD_ZCR_MIN) & (blockZcr <= VAD_ZCR_MAX)
+    speechSeconds = float(np.count_nonzero(isSpeechBlock) * AUDIO_FRAMES_PER_BLOCK / sampleRate)
+    peak = int(np.max(np.abs(samples.astype(np.int32))))
+
+    return {
+        "duration": samples.size / sampleRate,
+        "rms": float(np.sqrt(np.mean(blockRms * blockRms))),
+        "peak": peak,
+        "speechSeconds": speechSeconds,
+        "isSpeech": peak >= SILENCE_GATE_MIN_PEAK and speechSeconds >= minSpeechSeconds,
+    }
+
+
+def isSpeechInRecording(audio, settings):
+    '''return False if the silence gate finds no speech in the recording; the analysis is logged'''
+
+    if settings.silenceGateSeconds <= 0:
+        return True
+
+    speech = analyzeSpeechPresence(audio, settings.silenceGateSeconds)
+    if speech is None:
+        return True
+
+    speechMsg = ("Speech analysis: %.1f seconds, rms %.0f, peak %d, speech %.1f seconds"
+                 % (speech["duration"], speech["rms"], speech["peak"], speech["speechSeconds"]))
+    logger.info(speechMsg)
+    logToFile.info(speechMsg)
+
+    if not speech["isSpeech"]:
+        logToFile.info("No speech heard, skipping transcription")
+
+    return speech["isSpeech"]
+
+
+def resampleAudio(samples, fromRate, toRate):
+    '''
+    resample 16 bit samples from fromRate to toRate and return the new samples.
+    When downsampling, a short windowed-sinc low pass filter stops high frequencies from
+    aliasing; the output samples are then linearly interpolated. Everything is done as whole
+    array operations so a two minute recording takes a fraction of a second.
+    '''
+
+    if fromRate == toRate or samples.size < 2:
+        return samples
+
+    x = samples.astype(np.float32)
+
+    if toRate < fromRate:
+        # cut off a little below the new Nyquist frequency
+        cutoff = 0.45 * toRate / fromRate
+        n = np.arange(RESAMPLE_FILTER_TAPS) - (RESAMPLE_FILTER_TAPS - 1) / 2
+        taps = np.sinc(2 * cutoff * n) * np.hamming(RESAMPLE_FILTER_TAPS)
+        x = np.convolve(x, (taps / taps.sum()).astype(np.float32), mode="same")
+
+    positions = np.arange(int(x.size * toRate / fromRate)) * (fromRate / toRate)
+    y = np.interp(positions, np.arange(x.size), x)
+
+    return np.clip(np.round(y), -32768, 32767).astype(np.int16)
+
+
+def encodeAudioForUpload(audio, uploadFormat="flac"):
+    '''
+    shrink a recording before it is uploaded for transcription and return it as an in-memory file.
+    "flac" resamples to UPLOAD_SAMPLE_RATE and compresses, "wav" only resamples and "original"
+    sends the recording unchanged. If FLAC can't be written (soundfile not installed) WAV is sent.
+    '''
+
+    if uploadFormat == "original":
+        return audio
+
+    startTime = time.time()
+    try:
+        samples, sampleRate = readWavSamples(audio)
+    except (wave.Error, EOFError) as e:
+        # not a WAV file we understand (maybe an mp3 from -w), let the service deal with it
+        logger.info("Sending audio as is: " + str(e))
+        return audio
+
+    samples = resampleAudio(samples, sampleRate, UPLOAD_SAMPLE_RATE)
+
+    encoded = None
+    if uploadFormat == "flac" and soundfile is not None:
+        try:
+            encoded = io.BytesIO()
+            soundfile.write(encoded, samples, UPLOAD_SAMPLE_RATE, format="FLAC", subtype="PCM_16")
+            encoded.name = "recording.flac"
+            encoded.seek(0)
+        except Exception as e:
+            logger.warning("FLAC encoding failed, sending WAV: " + str(e))
+            encoded = None
+
+    if encoded is None:
+        encoded = makeWavBuffer([samples.tobytes()], UPLOAD_SAMPLE_RATE)
+
+    logger.info("Encoded %.1f seconds of audio for upload as %s, %d bytes, in %.2f seconds",
+                samples.size / UPLOAD_SAMPLE_RATE, encoded.name, len(encoded.getvalue()), time.time() - startTime)
+
+    return encoded
+
+
+class DiskCache:
+    '''
+    A persistent cache of JSON values, one small file per entry in a folder under CACHE_DIR.
+    Reading an entry touches its file, so the file times record when each entry was last used;
+    when there are more than maxEntries the least recently used ones are deleted.
+    If maxAge is given, entries older than maxAge seconds are treated as missing.
+    Hits and misses are counted for the status display and the log.
+    '''
+
+    def __init__(self, name, maxEntries, maxAge=None):
+        self.name = name
+        self.directory = os.path.join(CACHE_DIR, name)
+        self.maxEntries = maxEntries
+        self.maxAge = maxAge
+        self.isEnabled = True
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def makeKey(*parts):
+        '''return a hash of the parts (str or bytes) to use as a key'''
+        keyHash = hashlib.sha256()
+        for part in parts:
+            keyHash.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+            keyHash.update(b"\0")
+        return keyHash.hexdigest()
+
+    def get(self, key):
+        '''return the value stored for key, or None'''
+        if not self.isEnabled:
+            return None
+
+        path = os.path.join(self.directory, key + ".json")
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            value = entry["value"]
+            if self.maxAge is not None and time.time() - entry["created"] > self.maxAge:
+                # too old, ask again
+                os.remove(path)
+                value = None
+            else:
+                os.utime(path)  # mark as recently used
+        except (OSError, ValueError, KeyError, TypeError):
+            value = None
+
+        # chunks are transcribed on several threads at once
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return value
+
+    def put(self, key, value):
+        '''store value for key and evict the least recently used entries if the cache is full'''
+        if not self.isEnabled:
+            return
+
+        with self.lock:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, key + ".json")
+                # write then rename so a crash never leaves half an entry
+                with open(path + ".tmp", "w") as f:
+                    json.dump({"created": time.time(), "value": value}, f)
+                os.replace(path + ".tmp", path)
+                self.evict()
+            except OSError as e:
+                logger.warning("Could not write to the " + self.name + " cache: " + str(e))
+
+    def evict(self):
+        entries = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".json")]
+        if len(entries) <= self.maxEntries:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - self.maxEntries]:
+            os.remove(path)
+
+    def stats(self):
+        '''return a one line summary of how well the cache is doing'''
+        return f"{self.name} cache: {self.hits} hits, {self.misses} misses"
+
+transcriptCache = DiskCache("transcripts", TRANSCRIPT_CACHE_MAX_ENTRIES)
+llmCache = DiskCache("llm", LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_AGE)
+
+
+class CassetteMiss(LookupError):
+    '''raised when replaying and the cassette has no recording for a call'''
+
+
+class Cassette:
+    '''
+    Records the results of the OpenAI calls and image downloads to a folder under CASSETTE_DIR, and
+    plays them back, so the whole pipeline can be run and timed the same way again and again
+    without the network. Each wrapped function's results are filed under a key made from its
+    arguments; calls with the same key are replayed in the order they were recorded. Replays take
+    as long as the recorded call did, unless delays are turned off. Image bytes are kept in their
+    own files, everything else in cassette.json.
+    '''
+
+    def __init__(self):
+        self.mode = None
+        self.isDelayed = True
+        self.directory = None
+        self.entries = {}
+        self.replayCounts = {}
+        self.lock = threading.Lock()
+
+    def open(self, name, mode, isDelayed=True):
+        '''start recording to or replaying from the cassette called name'''
+
+        self.mode = mode
+        self.isDelayed = isDelayed
+        self.directory = os.path.join(CASSETTE_DIR, name)
+        self.entries = {}
+        self.replayCounts = {}
+
+        indexFile = os.path.join(self.directory, "cassette.json")
+        if os.path.exists(indexFile):
+            with open(indexFile, "r") as f:
+                self.entries = json.load(f)
+        elif mode == "replay":
+            raise CassetteMiss("No cassette at " + self.directory)
+
+        logger.info("Cassette %s: %s, %d recorded calls", name, mode,
+                    sum(len(calls) for calls in self.entries.values()))
+
+    def record(self, kind, key, result, seconds):
+        '''add a call's result and how long it took to the cassette'''
+
+        entry = {"kind": kind, "seconds": seconds}
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if isinstance(result, bytes):
+                # images go in their own files
+                entry["file"] = f"{key}-{len(self.entries.get(key, []))}.bin"
+                with open(os.path.join(self.directory, entry["file"]), "wb") as f:
+                    f.write(result)
+            else:
+                entry["value"] = result
+            self.entries.setdefault(key, []).append(entry)
+
+            # write then rename so a crash never leaves half a cassette
+            indexFile = os.path.join(self.directory, "cassette.json")
+            with open(indexFile + ".tmp", "w") as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(indexFile + ".tmp", indexFile)
+
+    def replay(self, kind, key):
+        '''return (result, seconds) for the next recorded call with key'''
+
+        with self.lock:
+            calls = self.entries.get(key)
+            if not calls:
+                raise CassetteMiss(f"No {kind} recorded for this input in {self.directory}")
+            # replay calls in order, repeating the last one if it is asked for more times than recorded
+            count = self.replayCounts.get(key, 0)
+            self.replayCounts[key] = count + 1
+            entry = calls[min(count, len(calls) - 1)]
+
+        if "file" in entry:
+            with open(os.path.join(self.directory, entry["file"]), "rb") as f:
+                return f.read(), entry["seconds"]
+        return entry["value"], entry["seconds"]
+
+    def wrap(self, kind, fn, keyFromArgs):
+        '''return fn wrapped to be recorded or replayed'''
+
+        def makeKey(args, kwargs):
+            return DiskCache.makeKey(kind, *keyFromArgs(*args, **kwargs))
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if self.mode == "replay":
+                result, seconds = self.replay(kind, makeKey(args, kwargs))
+                if self.isDelayed:
+                    time.sleep(seconds)
+                return result
+            startTime = time.time()
+            result = fn(*args, **kwargs)
+            if self.mode == "record":
+                self.record(kind, makeKey(args, kwargs), result, time.time() - startTime)
+            return result
+
+        return wrapper
+
+cassette = Cassette()
+
+
+def normalizeTextForCache(text):
+    '''return text with case, spacing and end punctuation evened out so small differences still match'''
+    return " ".join(text.lower().split()).strip(" .!?")
+
+
+class StageDeadlineExpired(Exception):
+    '''raised when a pipeline stage runs past its deadline'''
+
+    def __init__(self, stage, seconds):
+        super().__init__(f"{stage} took longer than {seconds:g} seconds")
+        self.stage = stage
+
+
+class StageDeadlines:
+    '''
+    Puts an upper bound on each stage of the pipeline. run() does the stage's work on a worker
+    thread while the main thread keeps the windows updated, and gives up with StageDeadlineExpired
+    once the stage's time in STAGE_DEADLINES is used. With deadlines off the work is still done on
+    a worker thread, so the windows keep updating however long it takes. The worker is told its deadline, so the
+    OpenAI request it is making times out at the same moment and anything it tries afterwards
+    fails straight away rather than running on in the background; work that loops, like a recording,
+    checks isStopping() and stops. Every expiry is counted and logged.
+    '''
+
+    def __init__(self):
+        self.isEnabled = True
+        self.expiries = {}
+        self.local = threading.local()
+
+    def seconds(self, stage, extraTime=0):
+        '''return the time allowed for stage, or None if deadlines are off'''
+        if not self.isEnabled:
+            return None
+        return STAGE_DEADLINES[stage] + extraTime
+
+    def recordExpiry(self, stage, seconds):
+        self.expiries[stage] = self.expiries.get(stage, 0) + 1
+        logger.warning("%s stage ran past its %g second deadline", stage, seconds)
+        logToFile.warning("Deadline expired: %s after %g seconds", stage, seconds)
+
+    def run(self, stage, fn, *args, extraTime=0, **kwargs):
+        '''call fn(*args, **kwargs) within the stage's deadline and return its result'''
+
+        seconds = self.seconds(stage, extraTime)
+        endTime = time.time() + seconds if seconds is not None else None
+        stopEvent = threading.Event()
+        result = concurrent.futures.Future()
+
+        def runStage():
+            try:
+                result.set_result(self.callInStage(stage, seconds, endTime, stopEvent, fn, *args, **kwargs))
+            except BaseException as e:
+                result.set_exception(e)
+
+        # a daemon thread, so one that never comes back can't stop the program from exiting
+        threading.Thread(target=runStage, daemon=True).start()
+
+        while not result.done():
+            if endTime is not None and time.time() > endTime:
+                # tell the stage to stop, in case it is one that can
+                stopEvent.set()
+                self.recordExpiry(stage, seconds)
+                raise StageDeadlineExpired(stage, seconds)
+            update_main_window()
+            concurrent.futures.wait([result], timeout=TK_UPDATE_INTERVAL)
+
+        return result.result()
+
+    def callInStage(self, stage, seconds, endTime, stopEvent, fn, *args, **kwargs):
+        '''call fn(*args, **kwargs) on this thread, telling it the stage's deadline'''
+        self.local.stage = stage
+        self.local.seconds = seconds
+        self.local.endTime = endTime
+        self.local.stopEvent = stopEvent
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # the thread may be a pool thread that goes on to do something else
+            self.local.endTime = None
+            self.local.stopEvent = None
+
+    async def runInThread(self, stage, fn, *args, extraTime=0, **kwargs):
+        '''run() for the async pipeline: call fn(*args, **kwargs) on a worker thread within the stage's deadline'''
+
+        seconds = self.seconds(stage, extraTime)
+        endTime = time.time() + seconds if seconds is not None else None
+        stopEvent = threading.Event()
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.to_thread(self.callInStage, stage, seconds, endTime, stopEvent, fn, *args, **kwargs), seconds)
+        except asyncio.TimeoutError:
+            stopEvent.set()
+            self.recordExpiry(stage, seconds)
+            raise StageDeadlineExpired(stage, seconds)
+
+    def isStopping(self):
+        '''return True if the current thread's stage has run out of time, so what it is doing should stop'''
+        stopEvent = getattr(self.local, "stopEvent", None)
+        return stopEvent is not None and stopEvent.is_set()
+
+    async def runAsync(self, stage, awaitable, extraTime=0):
+        '''await awaitable within the stage's deadline, cancelling it if time runs out'''
+
+        seconds = self.seconds(stage, extraTime)
+        if seconds is None:
+            return await awaitable
+
+        try:
+            return await asyncio.wait_for(awaitable, seconds)
+        except asyncio.TimeoutError:
+            self.recordExpiry(stage, seconds)
+            raise StageDeadlineExpired(stage, seconds)
+
+    def checkElapsed(self, stage, startTime):
+        '''record an expiry for a stage that can't be interrupted (it runs on the main thread)'''
+
+        seconds = self.seconds(stage)
+        if seconds is not None and time.time() - startTime > seconds:
+            self.recordExpiry(stage, seconds)
+
+    def remaining(self):
+        '''
+        return the seconds left before the current thread's stage deadline, or None if it has none.
+        raises StageDeadlineExpired if the deadline has already passed.
+        '''
+        endTime = getattr(self.local, "endTime", None)
+        if endTime is None:
+            return None
+
+        timeLeft = endTime - time.time()
+        if timeLeft <= 0:
+            raise self.expired()
+        return timeLeft
+
+    def expired(self):
+        '''return the StageDeadlineExpired for the current thread's stage'''
+        return StageDeadlineExpired(self.local.stage, self.local.seconds)
+
+    def stats(self):
+        if not self.expiries:
+            return "Deadlines: none expired"
+        return "Deadlines expired: " + ", ".join(f"{stage} {count}" for stage, count in self.expiries.items())
+
+stageDeadlines = StageDeadlines()
+
+
+class SpendBudgetExceeded(Exception):
+    '''raised instead of making an OpenAI call once the day's budget is spent'''
+
+
+class TokenBucket:
+    '''
+    Allows perMinute tokens a minute, in bursts of up to a minute's worth. Tokens can be taken
+    before they are there; the balance goes negative and reserve() says how long to wait for them,
+    so callers queue up in the order they asked.
+    '''
+
+    def __init__(self, perMinute):
+        self.ratePerSecond = perMinute / 60
+        self.capacity = perMinute
+        self.tokens = perMinute
+        self.lastTime = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.lastTime) * self.ratePerSecond)
+        self.lastTime = now
+
+    def predictWait(self, count):
+        '''return how many seconds a request for count tokens would wait'''
+        self.refill()
+        return max(0, (count - self.tokens) / self.ratePerSecond)
+
+    def reserve(self, count):
+        '''take count tokens and return how many seconds to wait before using them'''
+        self.refill()
+        self.tokens -= count
+        return max(0, -self.tokens / self.ratePerSecond)
+
+    def release(self, count):
+        '''give back count tokens that were reserved but not used'''
+        self.refill()
+        self.tokens = min(self.capacity, self.tokens + count)
+
+
+class RateLimiter:
+    '''
+    Keeps all of the OpenAI calls under a requests per minute and an images per minute limit, so
+    at a busy event the calls queue up and go through at the quota instead of failing and being
+    retried. Also adds up an estimate of what each call that went through costs (API_CALL_COSTS,
+    by the image, by the second of audio or by the call) and
+    refuses calls once the day's budget is spent. Today's spend is kept in SPEND_FILE so a restart
+    doesn't reset it.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requestBucket = TokenBucket(RATE_LIMIT_REQUESTS_PER_MINUTE)
+        self.imageBucket = TokenBucket(RATE_LIMIT_IMAGES_PER_MINUTE)
+        self.dailyBudget = DAILY_SPEND_BUDGET
+        self.day = None
+        self.spentToday = 0.0
+        self.spendWriter = BackgroundFileWriter(SPEND_FILE)
+        self.waitCount = 0
+        self.totalWait = 0.0
+
+    def configure(self, requestsPerMinute, imagesPerMinute, dailyBudget):
+        self.requestBucket = TokenBucket(requestsPerMinute)
+        self.imageBucket = TokenBucket(imagesPerMinute)
+        self.dailyBudget = dailyBudget
+        self.loadSpend()
+
+    def loadSpend(self):
+        self.day = datetime.date.today().isoformat()
+        self.spentToday = 0.0
+        try:
+            with open(SPEND_FILE, "r") as f:
+                spend = json.load(f)
+            if spend["date"] == self.day:
+                self.spentToday = spend["spent"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def saveSpend(self):
+        '''write today's spend out in the background; called with self.lock held so saves stay in order'''
+        self.spendWriter.save(json.dumps({"date": self.day, "spent": self.spentToday}))
+
+    def isOverBudget(self):
+        if datetime.date.today().isoformat() != self.day:
+            # a new day, a new budget
+            self.loadSpend()
+        return self.dailyBudget > 0 and self.spentToday >= self.dailyBudget
+
+    def predictWait(self, images=0):
+        '''return how many seconds the next call (asking for this many images) would wait its turn'''
+        with self.lock:
+            return max(self.requestBucket.predictWait(1), self.imageBucket.predictWait(images))
+
+    def reserve(self, stage, images=0, maxWait=None):
+        '''
+        count a call against the limits, and return how many seconds it must wait before it is made.
+        if that is longer than maxWait, nothing is taken and None is returned.
+        raises SpendBudgetExceeded if the budget is already spent.
+        '''
+        with self.lock:
+            if self.isOverBudget():
+                raise SpendBudgetExceeded(f"Today's budget of ${self.dailyBudget:.2f} has been spent")
+
+            if maxWait is not None:
+                wait = max(self.requestBucket.predictWait(1), self.imageBucket.predictWait(images))
+                if wait >= maxWait:
+                    logToFile.info("%s request would wait %.1f seconds for its turn, longer than it has", stage, wait)
+                    return None
+
+            wait = self.requestBucket.reserve(1)
+            if images:
+                wait = max(wait, self.imageBucket.reserve(images))
+
+            if wait > 0:
+                self.waitCount += 1
+                self.totalWait += wait
+                logToFile.info("%s request waiting %.1f seconds for its turn", stage, wait)
+
+        return wait
+
+    def release(self, images=0):
+        '''give back a reserved turn for a call that was never made'''
+        with self.lock:
+            self.requestBucket.release(1)
+            if images:
+                self.imageBucket.release(images)
+
+    def recordSpend(self, stage, units=1):
+        '''add what a call that went through costs to today's spend, units being images, seconds of audio or 1'''
+        with self.lock:
+            self.spentToday += API_CALL_COSTS.get(stage, 0) * units
+            self.saveSpend()
+
+    def stats(self):
+        return (f"Rate limits: {self.waitCount} calls waited {self.totalWait:.0f} seconds, "
+                f"spent about ${self.spentToday:.2f} today")
+
+rateLimiter = RateLimiter()
+
+
+def showRateLimitWait(labelForMessageDisplay, images=0):
+    '''if the next OpenAI call will have to wait its turn, tell the visitor how long it will be'''
+
+    wait = rateLimiter.predictWait(images)
+    if wait >= RATE_LIMIT_NOTICE_SECONDS:
+        display_text_in_message_window("Lots of pictures are being made right now.\n\r"
+                                       f"Yours will start in about {int(wait + 0.5)} seconds.", labelForMessageDisplay)
+
+
+def callOpenAI(stage, createFn, costUnits=None, **kwargs):
+    '''
+    make one OpenAI request for a pipeline stage, log how long it took and return the response.
+    costUnits is what the call is charged by, if not by the call or the image (seconds of audio)
+    '''
+
+    images = kwargs.get("n", 0)
+
+    # wait our turn, unless it won't come before the stage's deadline
+    wait = rateLimiter.reserve(stage, images, maxWait=stageDeadlines.remaining())
+    if wait is None:
+        raise stageDeadlines.expired()
+    time.sleep(wait)
+
+    # don't let the request outlive the stage it is for
+    try:
+        timeLeft = stageDeadlines.remaining()
+    except StageDeadlineExpired:
+        # the turn wasn't used, so someone else can have it
+        rateLimiter.release(images)
+        raise
+    if timeLeft is not None:
+        kwargs.setdefault("timeout", timeLeft)
+
+    startTime = time.time()
+    response = createFn(**kwargs)
+    logToFile.info("%s request took %.2f seconds", stage, time.time() - startTime)
+
+    # only requests that went through count towards the budget
+    rateLimiter.recordSpend(stage, costUnits if costUnits is not None else max(images, 1))
+
+    return response
+
+
+def rememberImageHost(url):
+    '''note the host the images come from so the next visitor's connection to it can be opened early'''
+    global imageHostURL
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme and parts.netloc:
+        imageHostURL = parts.scheme + "://" + parts.netloc + "/"
+
+
+def prewarmConnections(urls=None):
+    '''
+    open keep-alive connections to the OpenAI API and the image host on background threads, so
+    the TCP and TLS handshakes happen while the visitor is still talking rather than afterwards
+    '''
+
+    if urls is None:
+        urls = [OPENAI_API_URL, imageHostURL]
+    if cassette.mode == "replay":
+        return
+
+    def connect(url):
+        try:
+            # any answer will do, we only want the connection left in the pool
+            httpClient.head(url, timeout=HTTP_CONNECT_TIMEOUT)
+        except httpx.HTTPError as e:
+            logger.debug("Could not pre-warm " + url + ": " + str(e))
+
+    for url in urls:
+        threading.Thread(target=connect, args=(url,), daemon=True).start()
+
+
+def readAudioForUpload(audio):
+    '''return (file name, bytes) for a sound file name or an in-memory file from recordAudioFromMicrophone'''
+
+    if isinstance(audio, str):
+        with open(audio, "rb") as f:
+            return (os.path.basename(audio), f.read())
+    else:
+        return (audio.name, audio.getvalue())
+
+
+def audioSeconds(audioFile):
+    '''return how many seconds of audio are in audioFile, a (file name, bytes) from readAudioForUpload'''
+
+    try:
+        if soundfile is not None:
+            return soundfile.info(io.BytesIO(audioFile[1])).duration
+        with wave.open(io.BytesIO(audioFile[1])) as f:
+            return f.getnframes() / f.getframerate()
+    except Exception:
+        # a format we can't read, maybe an mp3 from -w
+        return UNKNOWN_AUDIO_SECONDS
+
+
+def getTranscript(audio):
+    '''
+    transcribe the audio and return the transcript
+    audio is either the name of a sound file or an in-memory file from recordAudioFromMicrophone
+    '''
+
+    audioFile = readAudioForUpload(audio)
+
+    # the same audio always gives the same transcript, so replays come from the cache
+    cacheKey = DiskCache.makeKey(TRANSCRIBE_MODEL, audioFile[1])
+    cached = transcriptCache.get(cacheKey)
+    if cached is not None:
+        logger.info("Transcript from cache (" + transcriptCache.stats() + ")")
+        logToFile.info("Transcript text (cached): " + cached["text"])
+        return cached["text"]
+
+    # transcribe the recording
+    logger.info("Transcribing...")
+    # used to use transcription.create, but the text comes back in the language spoken
+    responseTranscript = callOpenAI("Transcribe", client.audio.translations.create, audioSeconds(audioFile),
+        model=TRANSCRIBE_MODEL, 
+        file=audioFile)
+
+    # print the transcript object
+    loggerTrace.debug("Transcript object: " + str(responseTranscript))
+
+    transcript = responseTranscript.text 
+    #remove trailing period
+    transcript = transcript.rstrip(".")
+
+    loggerTrace.debug("Transcript text: " + transcript)
+    logToFile.info("Transcript text: " + transcript)
+
+    transcriptCache.put(cacheKey, {"text": transcript})
+
+    return transcript
+
+
+def stitchTranscripts(pieces):
+    '''
+    join the transcripts of overlapping chunks into one, dropping the words at the start of
+    each piece that repeat the end of the text before it
+    '''
+
+    def normalize(word):
+        return re.sub(r"[^\w']", "", word.lower())
+
+    words = []
+    for piece in pieces:
+        pieceWords = piece.split()
+        if not pieceWords:
+            continue
+
+        # find the longest run of words that ends the text so far and also starts this piece
+        tail = [normalize(w) for w in words[-TRANSCRIBE_OVERLAP_MAX_WORDS:]]
+        head = [normalize(w) for w in pieceWords[:TRANSCRIBE_OVERLAP_MAX_WORDS]]
+        repeated = 0
+        for n in range(min(len(tail), len(head)), 0, -1):
+            if tail[-n:] == head[:n]:
+                repeated = n
+                break
+
+        words.extend(pieceWords[repeated:])
+
+    return " ".join(words)
+
+
+class ChunkedTranscriber:
+    '''
+    Transcribe a long recording while it is still being recorded. Blocks are collected into chunks of
+    TRANSCRIBE_CHUNK_SECONDS and each full chunk is sent for translation on a small thread pool while
+    recording carries on, so once the recording ends only the last chunk is left to wait for.
+    Each chunk starts TRANSCRIBE_CHUNK_OVERLAP seconds before the previous one ended so a word cut at
+    the boundary is heard whole; the repeated words are removed when the pieces are stitched together.
+    '''
+
+    def __init__(self, sampleRate, uploadFormat="flac", silenceGateSeconds=0):
+        self.sampleRate = sampleRate
+        self.uploadFormat = uploadFormat
+        self.silenceGateSeconds = silenceGateSeconds
+        self.chunkBlocks = max(1, int(TRANSCRIBE_CHUNK_SECONDS * sampleRate / AUDIO_FRAMES_PER_BLOCK))
+        self.overlapBlocks = min(int(TRANSCRIBE_CHUNK_OVERLAP * sampleRate / AUDIO_FRAMES_PER_BLOCK), self.chunkBlocks // 2)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS)
+        self.futures = []
+        self.blocks = []
+        self.newBlockCount = 0
+
+    def addBlock(self, block):
+        '''add the next block of the recording, sending a chunk off when one is full'''
+        self.blocks.append(block)
+        self.newBlockCount += 1
+        if len(self.blocks) >= self.chunkBlocks:
+            self.submitChunk()
+
+    def submitChunk(self):
+        chunk = makeWavBuffer(self.blocks, self.sampleRate, name="chunk" + str(len(self.futures)) + ".wav")
+        self.futures.append(self.executor.submit(self.transcribeChunk, chunk))
+        # the next chunk starts with the end of this one
+        self.blocks = self.blocks[len(self.blocks) - self.overlapBlocks:]
+        self.newBlockCount = 0
+
+    def transcribeChunk(self, chunk):
+        if self.silenceGateSeconds > 0:
+            speech = analyzeSpeechPresence(chunk, self.silenceGateSeconds)
+            if speech is not None and not speech["isSpeech"]:
+                # whisper makes things up when given silence
+                return ""
+        return getTranscript(encodeAudioForUpload(chunk, self.uploadFormat))
+
+    def finish(self):
+        '''send whatever is left of the recording and return the stitched transcript of all the chunks'''
+        if self.newBlockCount > 0 or not self.futures:
+            self.submitChunk()
+
+        logger.info("Waiting for %d transcript chunks", len(self.futures))
+        try:
+            pieces = [future.result() for future in self.futures]
+        finally:
+            # if a chunk failed the rest aren't needed, but either way the pool's threads are done with
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+        transcript = stitchTranscripts(pieces)
+        logToFile.info("Stitched transcript from %d chunks", len(pieces))
+        return transcript
+
+    def cancel(self):
+        '''throw the recording away, cancelling any chunk that hasn't been sent yet'''
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def makeChunkedTranscriber(settings):
+    '''return a ChunkedTranscriber for a recording of settings.duration seconds, or None if it is too short to split'''
+    if not settings.isChunkedTranscription or settings.duration <= TRANSCRIBE_CHUNK_SECONDS:
+        return None
+    return ChunkedTranscriber(audioEngine.sampleRate, settings.uploadFormat, settings.silenceGateSeconds)
+
+
+def transcribeRecording(audio, transcriber, uploadFormat):
+    '''the transcribe stage of both pipelines: return the transcript of a recording'''
+    if transcriber is not None:
+        # most of the recording has already been transcribed in chunks
+        return transcriber.finish()
+    return getTranscript(encodeAudioForUpload(audio, uploadFormat))
+
+
+def getSummary(textInput):
+    '''summarize the transcript and return the summary'''
+    '''Used for very long text input - like minutes of speech'''
+    
+    # summarize the transcript 
+    logger.info("Summarizing...")
+
+    cacheKey = DiskCache.makeKey(CHAT_MODEL, PROMPT_FOR_SUMMARY, normalizeTextForCache(textInput))
+    summary = llmCache.get(cacheKey)
+    if summary is not None:
+        logger.info("Summary from cache (" + llmCache.stats() + ")")
+    else:
+        responseSummary = callOpenAI("Summary", client.chat.completions.create,
+                            model=CHAT_MODEL,
+                            messages=[
+                                {"role": "user", "content" : 
+                                f"{PROMPT_FOR_SUMMARY}{textInput}" }
+                            ])
+        loggerTrace.debug("responseSummary: " + str(responseSummary))
+
+        summary = responseSummary.choices[0].message.content.strip()
+        llmCache.put(cacheKey, summary)
+    
+    logger.debug("Summary: " + summary)
+    logToFile.info("Summary: " + summary)
+
+    return summary
+
+
+def getRollingSummary(previousSummary, transcript):
+    '''fold transcript into previousSummary and return the new summary of the conversation'''
+
+    logger.info("Updating the conversation summary...")
+
+    prompt = PROMPT_FOR_ROLLING_SUMMARY.format(maxWords=ROLLING_SUMMARY_MAX_WORDS)
+    cacheKey = DiskCache.makeKey(CHAT_MODEL, prompt, normalizeTextForCache(previousSummary),
+                                 normalizeTextForCache(transcript))
+    summary = llmCache.get(cacheKey)
+    if summary is None:
+        responseSummary = callOpenAI("Rolling summary", client.chat.completions.create,
+                            model=CHAT_MODEL,
+                            messages=[
+                                {"role": "user", "content" :
+                                f"{prompt}Summary so far: '''{previousSummary}'''\nWhat was said next: '''{transcript}'''" }
+                            ])
+        loggerTrace.debug("responseSummary: " + str(responseSummary))
+
+        summary = responseSummary.choices[0].message.content.strip()
+        llmCache.put(cacheKey, summary)
+
+    # hold the model to the length, or the prompt would creep up over a long session
+    summary = " ".join(summary.split()[:ROLLING_SUMMARY_MAX_WORDS])
+    logToFile.info("Rolling summary: " + summary)
+
+    return summary
+
+
+class RollingSummary:
+    '''
+    A running summary of the conversation for auto mode. Each new transcript segment is folded
+    into the summary so far instead of summarizing the whole conversation again, and the summary
+    is capped at ROLLING_SUMMARY_MAX_WORDS, so every update costs about the same however long the
+    session runs. Updates happen on a background thread while the keywords are being extracted,
+    so each picture sees the conversation up to the segment before its own.
+    '''
+
+    def __init__(self):
+        self.updateLock = threading.Lock()
+        self.summary = ""
+        self.segmentCount = 0
+        self.lastUpdateTime = 0
+
+    def isStale(self):
+        return time.time() - self.lastUpdateTime > ROLLING_SUMMARY_IDLE_RESET
+
+    def context(self):
+        '''return the summary of the conversation so far, or "" if a new conversation is starting'''
+        if self.isStale():
+            return ""
+        return self.summary
+
+    def foldIn(self, transcript):
+        '''fold a new transcript segment into the summary'''
+
+        # one update at a time, each one building on the last
+        with self.updateLock:
+            previousSummary = self.context()
+            if not previousSummary:
+                self.segmentCount = 0
+            try:
+                self.summary = getRollingSummary(previousSummary, transcript)
+            except Exception as e:
+                # keep the old summary, the next segment will try again
+                logger.error("Error updating the conversation summary: " + str(e))
+                logToFile.error("Error updating the conversation summary: " + str(e))
+                return
+            self.segmentCount += 1
+            self.lastUpdateTime = time.time()
+
+    def foldInBackground(self, transcript):
+        threading.Thread(target=self.foldIn, args=(transcript,), daemon=True).start()
+
+rollingSummary = RollingSummary()
+
+
+def addConversationContext(transcript, conversation):
+    '''return the text to extract keywords from: the transcript, with the conversation so far if there is one'''
+
+    if not conversation:
+        return transcript
+    return f"Earlier in the conversation: {conversation}\nJust now: {transcript}"
+
+
+def cleanAbstract(abstract):
+    '''tidy up the keywords that came back from OpenAI for use in the image prompt'''
+
+    # delete text before the first double quote
+    abstract = abstract[abstract.find("\"")+1:]
+    # delete text before the first colon
+    abstract = abstract[abstract.find(":")+1:]
+    # eliminate phrases that are not useful for image generation
+    badPhrases = ["the concept of", "in the supplied text is", "the most interesting concept"
+                    "in the text is"]
+    for phrase in badPhrases:
+        # compilation step to escape the word for all cases
+        compiled = re.compile(re.escape(phrase), re.IGNORECASE)
+        res = compiled.sub(" ", abstract)
+        abstract = str(res) 
+    
+    #remove trailing period
+    abstract = abstract.rstrip(".")
+
+    return abstract
+
+
+def getAbstractForImageGen(inputText):
+    '''get keywords for the image generator and return the keywords'''
+
+    # extract the keywords from the summary
+
+    logger.info("Extracting...")
+    logger.debug("Prompt for abstraction: " + PROMPT_FOR_ABSTRACTION)    
+
+    cacheKey = DiskCache.makeKey(CHAT_MODEL, PROMPT_FOR_ABSTRACTION, normalizeTextForCache(inputText))
+    response = llmCache.get(cacheKey)
+    if response is not None:
+        logger.info("Abstract from cache (" + llmCache.stats() + ")")
+    else:
+        prompt = PROMPT_FOR_ABSTRACTION + "'''" + inputText + "'''"
+        loggerTrace.debug ("prompt for extract: " + prompt)
+
+        responseForImage = callOpenAI("Keywords", client.chat.completions.create,
+                            model=CHAT_MODEL,
+                            messages=[
+                                {"role": "user", "content": prompt}
+                            ])
+
+        loggerTrace.debug("responseForImageGen: " + str(responseForImage))
+
+        # extract the abstract from the response
+        response = responseForImage.choices[0].message.content.strip()
+        llmCache.put(cacheKey, response)
+    
+    # Clean up the response from OpenAI
+    abstract = cleanAbstract(response)
+
+    logger.info("Abstract: " + abstract)
+    logToFile.info("Abstract: " + abstract)
+
+    return abstract
+
+
+def keywordWords(text):
+    '''return the lowercase words in text, with the punctuation that would break a phrase kept as ","'''
+    return re.findall(r"[a-z0-9']+(?:-[a-z0-9']+)*|[.,;:!?()\"]", text.lower())
+
+
+def keywordContentWords(text):
+    '''return the set of words in text that carry meaning, roughly singular, for comparing keywords'''
+    return {word.rstrip("s") for word in keywordWords(text)
+            if word.isalnum() and word not in KEYWORD_STOPWORDS}
+
+
+def getLocalKeywords(inputText):
+    '''
+    extract keywords for the image generator without calling the chat model, and return them.
+    This is RAKE: the text is cut into candidate phrases at stopwords and punctuation, each word
+    is scored by how many other words it appears alongside over how often it appears, and the best
+    phrases are kept. Words the speaker keeps coming back to get a bonus, since in speech the topic
+    tends to be repeated.
+    '''
+
+    # cut the text into candidate phrases
+    phrases = []
+    phrase = []
+    for word in keywordWords(inputText) + ["."]:
+        word = word.strip("'")
+        if (len(word) < 3 or word in KEYWORD_STOPWORDS or word.isdigit()
+                or len(phrase) == LOCAL_KEYWORDS_MAX_PHRASE_WORDS):
+            if phrase:
+                phrases.append(tuple(phrase))
+            phrase = []
+        if len(word) >= 3 and word not in KEYWORD_STOPWORDS and not word.isdigit():
+            phrase.append(word)
+
+    # score the words, then the phrases
+    frequency = {}
+    degree = {}
+    for phrase in phrases:
+        for word in phrase:
+            frequency[word] = frequency.get(word, 0) + 1
+            degree[word] = degree.get(word, 0) + len(phrase)
+    wordScores = {word: degree[word] / frequency[word] + frequency[word] - 1 for word in frequency}
+
+    phraseScores = {}
+    for phrase in phrases:
+        if phrase not in phraseScores:
+            phraseScores[phrase] = sum(wordScores[word] for word in phrase)
+
+    # keep the best phrases, up to the word limit, skipping ones that only repeat words already used
+    keywords = []
+    usedWords = set()
+    for phrase in sorted(phraseScores, key=phraseScores.get, reverse=True):
+        if set(phrase) <= usedWords:
+            continue
+        if len(usedWords) + len(phrase) > LOCAL_KEYWORDS_MAX_WORDS:
+            continue
+        keywords.append(" ".join(phrase))
+        usedWords.update(phrase)
+
+    abstract = ", ".join(keywords)
+    logger.info("Local keywords: " + abstract)
+    logToFile.info("Local keywords: " + abstract)
+
+    return abstract
+
+
+def isUsingLocalKeywords(transcript, keywordBackend):
+    '''return True if the keywords for transcript should be extracted locally'''
+
+    if keywordBackend == "auto":
+        return len(transcript.split()) <= LOCAL_KEYWORDS_MAX_TRANSCRIPT_WORDS
+    return keywordBackend == "local"
+
+
+def compareKeywordBackends(logFileName="s2plog.log"):
+    '''
+    compare the local keywords with the chat model's, for every transcript in the log file that the
+    chat model made keywords for. Scores are the overlap of the (non stopword) words in each, and the
+    local extraction time. Prints a line per transcript and the averages.
+    '''
+
+    # pair each chat model abstract with the transcript logged before it
+    logLine = re.compile(r" - INFO - (Transcript|Transcript text|Transcript text \(cached\)|Abstract): (.*)$")
+    pairs = []
+    transcript = None
+    with open(logFileName, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            match = logLine.search(line.rstrip("\n"))
+            if match is None:
+                continue
+            if match.group(1) == "Abstract":
+                if transcript is not None:
+                    pairs.append((transcript, match.group(2)))
+                transcript = None
+            else:
+                transcript = match.group(2)
+
+    if not pairs:
+        print("No transcripts with keywords found in " + logFileName)
+        return
+
+    totals = [0.0, 0.0, 0.0, 0.0]
+    for transcript, llmKeywords in pairs:
+        startTime = time.time()
+        localKeywords = getLocalKeywords(transcript)
+        seconds = time.time() - startTime
+
+        localWords = keywordContentWords(localKeywords)
+        llmWords = keywordContentWords(llmKeywords)
+        shared = len(localWords & llmWords)
+        precision = shared / len(localWords) if localWords else 0.0
+        recall = shared / len(llmWords) if llmWords else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if shared else 0.0
+        for i, value in enumerate((precision, recall, f1, seconds)):
+            totals[i] += value
+
+        print(f"\nTranscript: {transcript[:100]}")
+        print(f"   chat model: {llmKeywords}")
+        print(f"   local:      {localKeywords}")
+        print(f"   precision {precision:.2f}  recall {recall:.2f}  F1 {f1:.2f}  {seconds * 1000:.1f} ms")
+
+    count = len(pairs)
+    print(f"\n{count} transcripts: precision {totals[0] / count:.2f}  recall {totals[1] / count:.2f}  "
+          f"F1 {totals[2] / count:.2f}  average {totals[3] / count * 1000:.1f} ms")
+
+
+def makeImagePrompt(phrase):
+    '''return (prompt, modifierUsed) for the image generator'''
+
+    # pick random modifiers
+    random.shuffle(IMAGE_MODIFIERS)
+  
+    # create the prompt for the image generator
+    modifierUsed = IMAGE_MODIFIERS[0]
+    # if phrase contains stylistic information
+    if ("in the style of" in phrase.lower() 
+            or "as a painting by" in phrase.lower() 
+            or "as a photograph by" in phrase.lower() 
+            or "as a sketch by" in phrase.lower() 
+            or "as a watercolor by" in phrase.lower()):
+        modifierUsed = ""
+        prompt = f"Generate a picture WITHOUT ANY TEXT OR WRITING IN THE PICTURE for the following: '{phrase}'"
+    else:
+        # add a random modifier to the prompt
+        prompt = f"Generate a picture {modifierUsed} WITHOUT ANY TEXT OR WRITING IN THE PICTURE for the following: '{phrase}'"
+
+    logger.info("Generating image...")
+    logger.info("image prompt: " + prompt)
+
+    return prompt, modifierUsed
+
+
+def imageURLsFromResponse(responseImage):
+    '''
+    return the list of image urls in an image generation response
+    images sent inline (response_format="b64_json") are returned as data: URLs, which
+    downloadImages decodes without going to the network
+    '''
+
+    loggerTrace.debug("responseImage: " + str(responseImage)[:1000])   # inline images are long
+
+    image_url = []
+    for image in responseImage.data:
+        if getattr(image, "b64_json", None):
+            image_url.append("data:image/png;base64," + image.b64_json)
+        else:
+            image_url.append(image.url)
+
+    return image_url
+
+
+class ImageRequestPolicy:
+    '''
+    The retry and hedging rules for image generation, plus the history of request times that
+    hedging is based on. Only errors that might go away are retried; a content policy violation
+    never is. With hedging on, a request still running after the IMAGE_HEDGE_PERCENTILE latency
+    gets a twin, and whichever answers first is used.
+    '''
+
+    def __init__(self):
+        self.latencies = deque(maxlen=IMAGE_LATENCY_HISTORY)
+        self.isHedging = False
+        self.responseFormat = "url"    # or "b64_json" to have the images sent back inline
+        self.retryCount = 0
+        self.hedgeCount = 0
+
+    def recordLatency(self, seconds):
+        self.latencies.append(seconds)
+
+    def hedgeDelay(self):
+        '''return how long to wait before sending a hedged request, or None to not hedge'''
+        if not self.isHedging or len(self.latencies) < IMAGE_HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(self.latencies, IMAGE_HEDGE_PERCENTILE))
+
+    def isRetryable(self, e):
+        '''return True if the error might not happen again'''
+        if 'content_policy_violation' in str(e) or 'insufficient_quota' in str(e):
+            return False
+        if isinstance(e, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+            return True
+        return 'server had an error' in str(e) or 'something went wrong' in str(e)
+
+    def retryDelay(self, attempt):
+        '''return the backoff before retry number attempt (from 0), with jitter so kiosks don't retry in step'''
+        delay = min(IMAGE_RETRY_MAX_DELAY, IMAGE_RETRY_BASE_DELAY * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def stats(self):
+        return f"Image requests: {self.retryCount} retries, {self.hedgeCount} hedged"
+
+imagePolicy = ImageRequestPolicy()
+
+
+def getImageClient(openAIClient):
+    '''return the client to use for images; its own retries are turned off since we do our own'''
+    if hasattr(openAIClient, "with_options"):
+        return openAIClient.with_options(max_retries=0)
+    return openAIClient
+
+
+def generateImages(**kwargs):
+    '''call images.generate with retries, and a hedged second request if enabled; return the response'''
+
+    def timedRequest():
+        startTime = time.time()
+        response = callOpenAI("Image", getImageClient(client).images.generate, **kwargs)
+        imagePolicy.recordLatency(time.time() - startTime)
+        return response
+
+    def hedgedRequest():
+        hedgeDelay = imagePolicy.hedgeDelay()
+        if hedgeDelay is None:
+            return timedRequest()
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        try:
+            requests = [executor.submit(timedRequest)]
+            done, pending = concurrent.futures.wait(requests, timeout=hedgeDelay)
+            if not done:
+                imagePolicy.hedgeCount += 1
+                logToFile.info("Image request slower than %.1f seconds, sending a hedged request", hedgeDelay)
+                requests.append(executor.submit(timedRequest))
+
+            # use the first request to succeed; only fail if they all do
+            while True:
+                done, pending = concurrent.futures.wait(requests, return_when=concurrent.futures.FIRST_COMPLETED)
+                for request in done:
+                    if request.exception() is None:
+                        return request.result()
+                if not pending:
+                    raise done.pop().exception()
+                requests = list(pending)
+        finally:
+            executor.shutdown(wait=False)
+
+    for attempt in range(IMAGE_RETRY_ATTEMPTS):
+        try:
+            return hedgedRequest()
+        except Exception as e:
+            if attempt == IMAGE_RETRY_ATTEMPTS - 1 or not imagePolicy.isRetryable(e):
+                raise
+            delay = imagePolicy.retryDelay(attempt)
+            imagePolicy.retryCount += 1
+            logToFile.info("Image request failed, retrying in %.1f seconds: %s", delay, str(e))
+            time.sleep(delay)
+
+
+def getImageURL(phrase):
+    '''get images and return the urls'''
+
+    prompt, modifierUsed = makeImagePrompt(phrase)
+
+    # use openai to generate a picture based on the summary
+    try:
+        responseImage = generateImages(
+            prompt= prompt,
+            n=compositor.tileCount,
+            size=compositor.imageSize(),
+            response_format=imagePolicy.responseFormat)
+    except Exception as e:
+        print("\n\n\n")
+        print(e)
+        print("\n\n\n")
+        raise (e)
+
+    return imageURLsFromResponse(responseImage), modifierUsed
+
+
+class ImageSpeculation:
+    '''
+    Speculative image generation for long transcripts. Rather than wait for the chat model's keywords
+    before asking for the images, start() asks for them straight away using local keywords from the
+    transcript. Once the chat model's keywords are back, resolve() keeps the speculative images if the
+    two sets of keywords are mostly about the same things, and otherwise makes a new request with
+    the chat model's keywords. Every decision is logged with what it cost.
+    '''
+
+    def __init__(self):
+        self.keptCount = 0
+        self.refinedCount = 0
+        self.wastedCost = 0.0
+
+    def isWorthKeeping(self, speculativeKeywords, keywords):
+        '''return True if the speculative keywords cover enough of the chat model's keywords'''
+
+        wanted = keywordContentWords(keywords)
+        if not wanted:
+            return True
+        return len(wanted & keywordContentWords(speculativeKeywords)) / len(wanted) >= SPECULATION_KEEP_OVERLAP
+
+    def recordOutcome(self, isKept, reason, isBilled=True):
+        if isKept:
+            self.keptCount += 1
+            logToFile.info("Speculative images kept (%s), saved waiting for the keywords", reason)
+        else:
+            self.refinedCount += 1
+            requestCost = compositor.tileCount * API_CALL_COSTS["Image"] if isBilled else 0
+            self.wastedCost += requestCost
+            logToFile.info("Speculative images discarded (%s), wasted about $%.3f, $%.3f so far", reason,
+                           requestCost, self.wastedCost)
+
+    def start(self, transcript):
+        '''
+        start generating images from a rough cut of transcript on a thread, and return the speculation,
+        or None if there is nothing in transcript to make a rough cut from
+        '''
+
+        speculativeKeywords = getLocalKeywords(transcript)
+        if not speculativeKeywords:
+            return None
+        images = concurrent.futures.Future()
+
+        def generate():
+            try:
+                images.set_result(getImageURL(speculativeKeywords))
+            except Exception as e:
+                images.set_exception(e)
+
+        threading.Thread(target=generate, daemon=True).start()
+        logToFile.info("Speculative images started from: " + speculativeKeywords)
+
+        return speculativeKeywords, images
+
+    def resolve(self, speculation, keywords):
+        '''
+        return (imagesInfo, keywords the images were made from), keeping the speculation or not.
+        Called within the image stage, whose deadline covers the wait and any new request.
+        '''
+
+        speculativeKeywords, images = speculation
+        if self.isWorthKeeping(speculativeKeywords, keywords):
+            done, pending = concurrent.futures.wait([images], timeout=stageDeadlines.remaining())
+            if pending:
+                raise stageDeadlines.expired()
+            try:
+                imagesInfo = images.result()
+                self.recordOutcome(True, "keywords agree")
+                return imagesInfo, speculativeKeywords
+            except Exception as e:
+                # failed requests aren't billed; try again with the real keywords
+                self.recordOutcome(False, "speculative request failed: " + str(e), isBilled=False)
+        else:
+            # the request can't be called back; whatever it returns is ignored
+            self.abandon(speculation, "keywords differ: " + keywords)
+
+        return getImageURL(keywords), keywords
+
+    def abandon(self, speculation, reason):
+        '''give up on a speculation that won't be used, cancelling it if it hasn't finished'''
+
+        # cancelling stops the wait, but a request the server has started is still billed
+        images = speculation[1]
+        isBilled = True
+        if images.done():
+            isBilled = not images.cancelled() and images.exception() is None
+        else:
+            images.cancel()
+        self.recordOutcome(False, reason, isBilled)
+
+    def stats(self):
+        return (f"Speculative images: {self.keptCount} kept, {self.refinedCount} discarded, "
+                f"about ${self.wastedCost:.2f} wasted")
+
+imageSpeculation = ImageSpeculation()
+
+
+def makeImages(keywords, speculation=None):
+    '''the image stage of both pipelines: return (imagesInfo, keywords the images were made from)'''
+    if speculation is not None:
+        return imageSpeculation.resolve(speculation, keywords)
+    return getImageURL(keywords), keywords
 
-    soundFileName = 'recording.wav'
-    
-    # delete file recording.wav if it exists
-    try:
-        os.remove(soundFileName)
-    except:
-        pass # do nothing   
-    
-    if g_isMacOS:
-        # print the devices
-        # print(sd.query_devices())  # in case you have trouble with the devices
 
-        # Set the sample rate and number of channels for the recording
-        sample_rate = int(sounddevice.query_devices(1)['default_samplerate'])
-        channels = 1
+class ImageCache:
+    '''
+    Remembers the picture made for each set of keywords, so when a visitor asks for something close
+    to an earlier request the picture can be shown straight away. Keywords are compared as sets of
+    words weighted by how rare each word is among the cached keywords (IDF), so "a cat on the moon"
+    matches "the cat on a moon" but "a dog on the moon" doesn't match just on "moon".
+    To keep things fresh, old pictures aren't reused, a picture isn't reused too often or shown twice
+    in a row, and now and then a new picture is made anyway. The index is a JSON file in CACHE_DIR;
+    the pictures themselves are the composites in history/.
+    '''
 
-        logger.debug('sample_rate: %d; channels: %d', sample_rate, channels)
+    def __init__(self):
+        self.indexFile = os.path.join(CACHE_DIR, "images.json")
+        self.indexWriter = BackgroundFileWriter(self.indexFile)
+        self.entries = None     # read on first use
+        self.isEnabled = True
+        self.matchThreshold = IMAGE_CACHE_MATCH_THRESHOLD
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.entries is not None:
+            return
+        try:
+            with open(self.indexFile, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = []
+
+    def save(self):
+        '''write the index out in the background; called with self.lock held so saves stay in order'''
+        self.indexWriter.save(json.dumps(self.entries))
+
+    def similarity(self, words, entryWords, idf):
+        '''return the IDF weighted overlap of two sets of words, 0 to 1'''
+        union = words | entryWords
+        if not union:
+            return 0.0
+        return sum(idf[word] for word in words & entryWords) / sum(idf[word] for word in union)
+
+    def find(self, keywords):
+        '''return the file name of an earlier picture to show for keywords, or None'''
+        if not self.isEnabled:
+            return None
+
+        with self.lock:
+            self.load()
+            words = keywordContentWords(keywords)
+            now = time.time()
+            entries = [entry for entry in self.entries
+                       if now - entry["created"] <= IMAGE_CACHE_MAX_AGE and os.path.exists(entry["file"])]
+
+            # rare words count for more than common ones
+            documentFrequency = {}
+            for entry in entries:
+                for word in entry["words"]:
+                    documentFrequency[word] = documentFrequency.get(word, 0) + 1
+            idf = {word: math.log((len(entries) + 1) / (documentFrequency.get(word, 0) + 1)) + 1
+                   for word in words.union(*(entry["words"] for entry in entries))}
+
+            matches = [entry for entry in entries
+                       if self.similarity(words, set(entry["words"]), idf) >= self.matchThreshold]
+            usable = [entry for entry in matches
+                      if entry["reuses"] < IMAGE_CACHE_MAX_REUSES and now - entry["lastShown"] >= IMAGE_CACHE_REPEAT_GAP]
+
+            if not usable or random.random() < IMAGE_CACHE_REFRESH_CHANCE:
+                self.misses += 1
+                return None
+
+            # the least shown of the matches, so they all get a turn
+            random.shuffle(usable)
+            entry = min(usable, key=lambda entry: entry["reuses"])
+            entry["reuses"] += 1
+            entry["lastShown"] = now
+            self.save()
+            self.hits += 1
+        logger.info("Picture from cache for: " + entry["keywords"])
+        logToFile.info("Image cache hit: '%s' for '%s'", entry["keywords"], keywords)
+        return entry["file"]
+
+    def add(self, keywords, fileName):
+        '''remember that fileName is the picture made for keywords'''
+        if not self.isEnabled:
+            return
+
+        with self.lock:
+            self.load()
+            now = time.time()
+            self.entries.append({"keywords": keywords, "words": sorted(keywordContentWords(keywords)),
+                                 "file": fileName, "created": now, "reuses": 0, "lastShown": now})
+            # forget the oldest pictures once there are too many
+            del self.entries[:-IMAGE_CACHE_MAX_ENTRIES]
+            self.save()
+
+    def stats(self):
+        return f"image cache: {self.hits} hits, {self.misses} misses"
+
+imageCache = ImageCache()
+
+
+class Compositor:
+    '''
+    Lays out the images OpenAI makes into the one picture that is displayed: how many tiles, the
+    grid they go in, the size they are asked for at and the width of the finished picture, with a
+    caption bar under them. The fonts, the caption bar and the canvas are made once per layout and
+    reused for every picture, and captions are fitted to the width by measuring them.
+    '''
 
-        logger.info("Recording %d seconds...", duration)
-        # Record audio from the default microphone
-        recording = sounddevice.rec(
-            int(duration * sample_rate), 
-            samplerate=sample_rate, 
-            channels=channels
-            )
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fonts = {}
+        self.configure(IMAGES_PER_REQUEST, None, COMPOSITE_TILE_SIZE, 0)
+
+    def configure(self, tileCount, grid, tileSize, outputWidth):
+        '''
+        set the layout. grid is (columns, rows), or None for the usual one for tileCount.
+        outputWidth is the width of the finished picture in pixels, or 0 for the tiles at full size
+        '''
+
+        if grid is None:
+            grid = self.defaultGrid(tileCount)
+        if grid[0] * grid[1] < tileCount:
+            raise ValueError(f"A {grid[0]}x{grid[1]} grid has no room for {tileCount} tiles")
+        if outputWidth and outputWidth // grid[0] < COMPOSITE_MIN_CELL_SIZE:
+            raise ValueError(f"A picture {outputWidth} pixels wide is too narrow for {grid[0]} columns")
+
+        with self.lock:
+            self.tileCount = tileCount
+            self.columns, self.rows = grid
+            self.tileSize = tileSize
+            # tiles are shown at this size, which is tileSize unless the picture is to be a set width
+            self.cellSize = outputWidth // self.columns if outputWidth else tileSize
+
+            # the caption and its font keep the same proportions as with 512 pixel tiles, but stay readable
+            scale = self.cellSize / 512
+            self.captionHeight = max(int(COMPOSITE_CAPTION_HEIGHT * scale), 30)
+            self.captionFontSize = max(int(COMPOSITE_CAPTION_FONT_SIZE * scale), COMPOSITE_CAPTION_MIN_FONT_SIZE)
+            self.errorFontSize = max(int(COMPOSITE_ERROR_FONT_SIZE * scale), COMPOSITE_CAPTION_MIN_FONT_SIZE)
+
+            self.size = (self.columns * self.cellSize, self.rows * self.cellSize + self.captionHeight)
+            self.captionBar = Image.new('RGB', (self.size[0], self.captionHeight))
+            self.canvas = None
+
+    @staticmethod
+    def defaultGrid(tileCount):
+        '''return the usual (columns, rows) for tileCount tiles'''
+        grid = COMPOSITE_GRIDS.get(tileCount)
+        if grid is None:
+            columns = math.ceil(math.sqrt(tileCount))
+            grid = (columns, math.ceil(tileCount / columns))
+        return grid
+
+    def imageSize(self):
+        '''the size to ask OpenAI for'''
+        return f"{self.tileSize}x{self.tileSize}"
+
+    def font(self, size):
+        if size not in self.fonts:
+            try:
+                self.fonts[size] = ImageFont.truetype(COMPOSITE_FONT, size)
+            except OSError:
+                logToFile.warning("Font %s not found, using the default font", COMPOSITE_FONT)
+                self.fonts[size] = ImageFont.load_default()
+        return self.fonts[size]
+
+    def blankCanvas(self):
+        return Image.new('RGB', self.size)
+
+    def pasteTile(self, canvas, index, img):
+        '''put tile number index in its place in the grid on canvas'''
+        if img.size != (self.cellSize, self.cellSize):
+            img = img.resize((self.cellSize, self.cellSize), Image.BILINEAR)
+        canvas.paste(img, ((index % self.columns) * self.cellSize, (index // self.columns) * self.cellSize))
+
+    def fitCaption(self, caption, maxWidth):
+        '''return the font and text for caption, shrinking it and then cutting it short to fit in maxWidth'''
+
+        for size in range(self.captionFontSize, COMPOSITE_CAPTION_MIN_FONT_SIZE - 1, -1):
+            font = self.font(size)
+            if font.getlength(caption) <= maxWidth:
+                return font, caption
+
+        words = caption.split()
+        while words and font.getlength(" ".join(words) + "...") > maxWidth:
+            words.pop()
+        return font, " ".join(words) + "..."
+
+    def compose(self, imgObjects, caption, fileName):
+        '''combine the images into one with caption under them and save it as fileName'''
+
+        with self.lock:
+            if self.canvas is None:
+                self.canvas = self.blankCanvas()
+
+            for index in range(self.columns * self.rows):
+                if index < len(imgObjects) and index < self.tileCount:
+                    self.pasteTile(self.canvas, index, imgObjects[index])
+                else:
+                    # left over from a picture with more tiles
+                    x = (index % self.columns) * self.cellSize
+                    y = (index // self.columns) * self.cellSize
+                    self.canvas.paste((0, 0, 0), (x, y, x + self.cellSize, y + self.cellSize))
+
+            # add text at the bottom
+            captionTop = self.size[1] - self.captionHeight
+            self.canvas.paste(self.captionBar, (0, captionTop))
+            font, text = self.fitCaption(caption, self.size[0] - 20)
+            draw = ImageDraw.Draw(self.canvas)
+            draw.text((10, captionTop + self.captionHeight * 2 // 5), text, (255,255,255), font=font)
+
+            self.canvas.save(fileName)
+
+    def composeError(self, message, fileName):
+        '''make a picture of an error message, the same size as the others, and save it as fileName'''
+
+        new_im = self.blankCanvas()
+        draw = ImageDraw.Draw(new_im)
+        font = self.font(self.errorFontSize)
+
+        # wrap the text to the width of the picture
+        margin = new_im.width // 10
+        lines = []
+        for word in message.split():
+            if lines and font.getlength(lines[-1] + " " + word) <= new_im.width - 2 * margin:
+                lines[-1] += " " + word
+            else:
+                lines.append(word)
 
-        # Wait for the recording to finish
-        sounddevice.wait()
+        y_text = new_im.height/2
+        for line in lines:
+            draw.text((margin, y_text), line, font=font)
+            y_text += self.errorFontSize + 1
 
-        # Save the recording to a WAV file
-        soundfile.write(soundFileName, recording, sample_rate)
+        new_im.save(fileName)
 
-    else:
+compositor = Compositor()
 
-        # RPi
- 
-        # all this crap because the ALSA library can't police itself
-        ERROR_HANDLER_FUNC = CFUNCTYPE(None, c_char_p, c_int, c_char_p, c_int, c_char_p)
-        def py_error_handler(filename, line, function, err, fmt):
-            pass #nothing to see here
-        c_error_handler = ERROR_HANDLER_FUNC(py_error_handler)
-        asound = cdll.LoadLibrary('libasound.so')
-        # Set error handler
-        asound.snd_lib_error_set_handler(c_error_handler)
-        # Initialize PyAudio
-        pa = pyaudio.PyAudio()
-        # Reset to default error handler
-        asound.snd_lib_error_set_handler(None)
-        # now on with the show, sheesh
-
-        stream = pa.open(
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=44100,
-            input=True,
-            frames_per_buffer=1024
-            ) #,input_device_index=2)
-
-        wf = wave.open(soundFileName,"wb")
-        wf.setnchannels(1)
-        wf.setsampwidth(pa.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(44100)
-
-        # Write the audio data to the file
-        for i in range(0, int(44100/1024*10)):
-
-            # Get the audio data from the microphone
-            data = stream.read(1024)
-
-            # Write the audio data to the file
-            wf.writeframes(data)
-
-        # Close the microphone and the wave file
-        stream.close()
-        wf.close()
 
-    return soundFileName
+def compositeImages(imgObjects, imageModifiers, keywords, timestr, filePrefix):
+    '''combine the images into one with a caption, save it and return the new file name'''
 
+    newFileName = "history/" + filePrefix + timestr + "-image" + ".png"
+    compositor.compose(imgObjects, f'{keywords} {imageModifiers}', newFileName)
 
+    return newFileName
 
 
-def getTranscript(wavFileName):
-    '''transcribe the audio file and return the transcript'''
+def checkDownloadSize(url, size):
+    if size > DOWNLOAD_MAX_BYTES:
+        raise ValueError(f"Image from {url} is larger than {DOWNLOAD_MAX_BYTES} bytes")
 
-    # transcribe the recording
-    logger.info("Transcribing...")
-    audio_file= open(wavFileName, "rb")
-    # used to use transcription.create, but the text comes back in the language spoken
-    responseTranscript = client.audio.translations.create(
-        model="whisper-1", 
-        file=audio_file)
 
-    # print the transcript object
-    loggerTrace.debug("Transcript object: " + str(responseTranscript))
+def fetchImage(url, **requestOptions):
+    '''download one image into memory and return its bytes'''
 
-    transcript = responseTranscript.text 
-    #remove trailing period
-    transcript = transcript.rstrip(".")
+    rememberImageHost(url)
+    with httpClient.stream("GET", url, **requestOptions) as response:
+        response.raise_for_status()
+        # stop as soon as we know it is too big, rather than after reading it all
+        checkDownloadSize(url, int(response.headers.get("Content-Length", 0)))
+        content = bytearray()
+        for chunk in response.iter_bytes():
+            content += chunk
+            checkDownloadSize(url, len(content))
 
-    loggerTrace.debug("Transcript text: " + transcript)
-    logToFile.info("Transcript text: " + transcript)
+    return bytes(content)
 
-    return transcript
 
+def decodeImage(content):
+    '''return a PIL image decoded from the bytes of an image file, refusing ones that are too big'''
 
-def getSummary(textInput):
-    '''summarize the transcript and return the summary'''
-    '''Used for very long text input - like minutes of speech'''
-    
-    # summarize the transcript 
-    logger.info("Summarizing...")
+    img = Image.open(io.BytesIO(content))
+    # the size comes from the header, so this is known before decoding
+    if img.width * img.height > IMAGE_MAX_PIXELS:
+        raise ValueError(f"Image is too big to show ({img.width}x{img.height})")
+    img.load()
 
-    responseSummary = client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "user", "content" : 
-                            f"Please summarize the following text:\n{textInput}" }
-                        ])
-    loggerTrace.debug("responseSummary: " + str(responseSummary))
+    return img
 
-    summary = responseSummary.choices[0].message.content.strip()
-    
-    logger.debug("Summary: " + summary)
-    logToFile.info("Summary: " + summary)
 
-    return summary
+def isRetryableDownloadError(e):
+    '''return True if a failed download might work if tried again'''
+    if isinstance(e, httpx.HTTPStatusError):
+        # an expired or missing image won't come back, a busy server might
+        return e.response.status_code >= 500 or e.response.status_code == 429
+    return isinstance(e, httpx.TransportError)
 
 
-def getAbstractForImageGen(inputText):
-    '''get keywords for the image generator and return the keywords'''
+def fetchImageWithRetry(url, endTime=None):
+    '''fetchImage with a timeout of its own, tried again if the network lets us down, but not past endTime'''
 
-    # extract the keywords from the summary
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        timeout = DOWNLOAD_TIMEOUT
+        if endTime is not None:
+            timeout = max(0.1, min(timeout, endTime - time.time()))
+        try:
+            return fetchImage(url, timeout=timeout)
+        except httpx.HTTPError as e:
+            isOutOfTime = endTime is not None and time.time() + DOWNLOAD_RETRY_DELAY >= endTime
+            if attempt == DOWNLOAD_ATTEMPTS - 1 or isOutOfTime or not isRetryableDownloadError(e):
+                raise
+            logToFile.info("Image download failed, retrying: " + str(e))
+            time.sleep(DOWNLOAD_RETRY_DELAY * (attempt + 1))
 
-    logger.info("Extracting...")
-    logger.debug("Prompt for abstraction: " + PROMPT_FOR_ABSTRACTION)    
 
-    prompt = PROMPT_FOR_ABSTRACTION + "'''" + inputText + "'''"
-    loggerTrace.debug ("prompt for extract: " + prompt)
+def decodeDataURL(url):
+    '''return the bytes in a base64 data: URL'''
+    return base64.b64decode(url.partition(",")[2])
 
-    responseForImage = client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "user", "content": prompt}
-                        ])
 
-    loggerTrace.debug("responseForImageGen: " + str(responseForImage))
+def downloadImages(imageURLs, isSaveFiles=False, onTile=None):
+    '''
+    download the images, all at the same time, and return them as PIL images
+    each one can be a URL, a data: URL (an inline image, nothing to download) or already a PIL image.
+    they are decoded in memory; only if isSaveFiles is True are they also written to history/
+    if onTile is given, it is called with (index, image) as each one is ready
+    '''
 
-    # extract the abstract from the response
-    abstract = responseForImage.choices[0].message.content.strip()
-    
-    # Clean up the response from OpenAI
-    # delete text before the first double quote
-    abstract = abstract[abstract.find("\"")+1:]
-    # delete text before the first colon
-    abstract = abstract[abstract.find(":")+1:]
-    # eliminate phrases that are not useful for image generation
-    badPhrases = ["the concept of", "in the supplied text is", "the most interesting concept"
-                    "in the text is"]
-    for phrase in badPhrases:
-        # compilation step to escape the word for all cases
-        compiled = re.compile(re.escape(phrase), re.IGNORECASE)
-        res = compiled.sub(" ", abstract)
-        abstract = str(res) 
-    
-    #remove trailing period
-    abstract = abstract.rstrip(".")
+    # the stage deadline is kept by this thread, so tell the download threads when it is
+    timeLeft = stageDeadlines.remaining()
+    endTime = time.time() + timeLeft if timeLeft is not None else None
 
-    logger.info("Abstract: " + abstract)
-    logToFile.info("Abstract: " + abstract)
+    def download(numURL):
+        if isinstance(imageURLs[numURL], Image.Image):
+            img = imageURLs[numURL]
+        else:
+            if imageURLs[numURL].startswith("data:"):
+                content = decodeDataURL(imageURLs[numURL])
+            else:
+                content = fetchImageWithRetry(imageURLs[numURL], endTime)
+            if isSaveFiles:
+                saveFileInBackground("history/" + "image" + str(numURL) + ".png", content)
+            img = decodeImage(content)
 
-    return abstract
+        if onTile is not None:
+            onTile(numURL, img)
+        return img
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        imgObjects = list(executor.map(download, range(len(imageURLs))))
 
-def getImageURL(phrase):
-    '''get images and return the urls'''
+    return imgObjects
 
-    # pick random modifiers
-    random.shuffle(IMAGE_MODIFIERS)
-  
-    # create the prompt for the image generator
-    modifierUsed = IMAGE_MODIFIERS[0]
-    # if phrase contains stylistic information
-    if ("in the style of" in phrase.lower() 
-            or "as a painting by" in phrase.lower() 
-            or "as a photograph by" in phrase.lower() 
-            or "as a sketch by" in phrase.lower() 
-            or "as a watercolor by" in phrase.lower()):
-        modifierUsed = ""
-        prompt = f"Generate a picture WITHOUT ANY TEXT OR WRITING IN THE PICTURE for the following: '{phrase}'"
-    else:
-        # add a random modifier to the prompt
-        prompt = f"Generate a picture {modifierUsed} WITHOUT ANY TEXT OR WRITING IN THE PICTURE for the following: '{phrase}'"
 
-    logger.info("Generating image...")
-    logger.info("image prompt: " + prompt)
+def postProcessImages(imageURLs, imageModifiers, keywords, timestr, filePrefix, isSaveFiles=False, onTile=None):
+    '''reformat the images for display and return the new file name'''
 
-    # use openai to generate a picture based on the summary
-    try:
-        responseImage = client.images.generate(
-            prompt= prompt,
-            n=4,
-            size="512x512")
-    except Exception as e:
-        print("\n\n\n")
-        print(e)
-        print("\n\n\n")
-        raise (e)
-        
-    loggerTrace.debug("responseImage: " + str(responseImage))
+    imgObjects = stageDeadlines.run("download", downloadImages, imageURLs, isSaveFiles, onTile)
 
-    image_url = [responseImage.data[0].url] * 4
-    image_url[1] = responseImage.data[1].url
-    image_url[2] = responseImage.data[2].url
-    image_url[3] = responseImage.data[3].url
+    return stageDeadlines.run("composite", compositeImages, imgObjects, imageModifiers, keywords, timestr, filePrefix)
 
-    return image_url, modifierUsed
 
+# Record or replay the OpenAI calls and image downloads when a cassette is open (see Cassette).
+# The async pipeline makes the same calls on threads, so a run recorded one way can be replayed the other
+getTranscript = cassette.wrap("transcript", getTranscript, lambda audio: [readAudioForUpload(audio)[1]])
+getSummary = cassette.wrap("summary", getSummary, lambda textInput: [textInput])
+getRollingSummary = cassette.wrap("rolling summary", getRollingSummary,
+                                  lambda previousSummary, transcript: [previousSummary, transcript])
+getAbstractForImageGen = cassette.wrap("keywords", getAbstractForImageGen, lambda inputText: [inputText])
+getImageURL = cassette.wrap("image", getImageURL, lambda phrase: [phrase])
+fetchImage = cassette.wrap("image download", fetchImage, lambda url, **requestOptions: [url])
 
-def postProcessImages(imageURLs, imageModifiers, keywords, timestr, filePrefix):
-    '''reformat the images for display and return the new file name'''
 
-    # save the images from a urls into imgObjects[]
-    imgObjects = []
-    for numURL in range(len(imageURLs)):
-
-        fileName = "history/" + "image" + str(numURL) + ".png"
-        urllib.request.urlretrieve(imageURLs[numURL], fileName)
-
-        img = Image.open(fileName)
-
-        imgObjects.append(img)
-
-    # combine the images into one image
-    #widths, heights = zip(*(i.size for i in imgObjects))
-    total_width = 512*2
-    max_height = 512*2 + 50
-    new_im = Image.new('RGB', (total_width, max_height))
-    locations = [(0,0), (512,0), (0,512), (512,512)]
-    count = -1
-    for loc in locations:
-        count += 1
-        new_im.paste(imgObjects[count], loc)
-
-    # add text at the bottom
-    imageCaption = f'{keywords} {imageModifiers}'
-    draw = ImageDraw.Draw(new_im)
-    draw.rectangle(((0, new_im.height - 50), (new_im.width, new_im.height)), fill="black")
-    font = ImageFont.truetype("arial.ttf", 18)
-    # decide if text will exceed the width of the image
-    #textWidth, textHeight = font.getsize(text)
-    draw.text((10, new_im.height - 30), imageCaption, (255,255,255), font=font)
-
-    # save the combined image
-    newFileName = "history/" + filePrefix + timestr + "-image" + ".png"
-    new_im.save(newFileName)
+def benchmarkImageFormats(count, phrase="a lighthouse on a rocky coast at sunset"):
+    '''
+    time count image requests with each response format, from asking for the images to having
+    them decoded and ready to combine, and print the averages. Inline images skip the download
+    but make the response itself much bigger, so which is faster depends on the network.
+    '''
 
-    return newFileName
+    print(f"Timing {count} image requests of {compositor.tileCount} images with each response format...")
+    results = {}
+    for responseFormat in ("url", "b64_json"):
+        imagePolicy.responseFormat = responseFormat
+        generateTimes = []
+        downloadTimes = []
+        for i in range(count):
+            startTime = time.time()
+            imageURLs, modifierUsed = getImageURL(phrase)
+            generatedTime = time.time()
+            downloadImages(imageURLs)
+            generateTimes.append(generatedTime - startTime)
+            downloadTimes.append(time.time() - generatedTime)
+            print(f"   {responseFormat}: request {generateTimes[-1]:.2f}s, download and decode {downloadTimes[-1]:.2f}s")
+        results[responseFormat] = (sum(generateTimes) / count, sum(downloadTimes) / count)
+
+    for responseFormat, (generateTime, downloadTime) in results.items():
+        print(f"{responseFormat:>8}: request {generateTime:.2f}s + download and decode {downloadTime:.2f}s "
+              f"= {generateTime + downloadTime:.2f}s on average")
+    logToFile.info("Image format benchmark: " + str(results))
+
+
+def imageErrorMessage(e):
+    '''return the message to show the visitor when making the picture failed with exception e'''
+
+    if isinstance(e, StageDeadlineExpired):
+        msg = DEADLINE_MESSAGE
+    elif isinstance(e, SpendBudgetExceeded):
+        msg = BUDGET_MESSAGE
+    elif 'content_policy_violation' in str(e):
+        # this is a common error, so we'll display a message to the user
+        msg = f'Content Policy Violation.  Your prompt may contain text that is not allowed by our safety system.'
+    elif 'something went wrong' in str(e):
+        msg = f'Something went wrong with the OpenAI image generation.  Please try again'
+    elif 'server had an error' in str(e):
+        msg = f'OpenAI had an unspecified server error.  Please try again'
+    else:
+        msg = f'We had an error:\n\r "{str(e)}" \n\r\n\rPlease try again.'
+
+    return msg
 
 
 def generateErrorImage(e, timestr):
     '''generate an image with the error message and return the new file name'''
 
-    # make an image to display the error
-    total_width = 512*2
-    max_height = 512*2 + 50
-    new_im = Image.new('RGB', (total_width, max_height))
-    draw = ImageDraw.Draw(new_im)
-    draw.rectangle(((0, 0), (new_im.width, new_im.height)), fill="black")
-    
     # add error text
     imageCaption = str(e)
     logToFile.error("Error: " + imageCaption)
-    
-    font = ImageFont.truetype("arial.ttf", 24)
-    # decide if text will exceed the width of the image
-    #textWidth, textHeight = font.getsize(text)
-
-    import textwrap
-    lines = textwrap.wrap(imageCaption, width=60)  #width is characters
-    y_text = new_im.height/2
-    for line in lines:
-        #width, height = font.getsize(line)
-        #draw.text(((new_im.width - width) / 2, y_text), line, font=font) 
-        #y_text += height
-        height = 25
-        draw.text((100, y_text), line, font=font) 
-        y_text += height
-
-    #draw.text((10, new_im.height/2), imageCaption, (255,255,255), font=font)
-
-    # save the new image
+
+    # make an image to display the error, and save it
     newFileName = "errors/" + timestr + "-imageERROR" + ".png"
-    new_im.save(newFileName)
+    compositor.composeError(imageCaption, newFileName)
 
     return newFileName
 
 ''' 
 Window functions
 '''
-def create_main_window(usingHardwareButton):
+def create_main_window(usingHardwareButton, isHoldToTalk=False):
     '''
     Create the main window and return the label to display the images
     '''
@@ -795,6 +3237,11 @@ def create_main_window(usingHardwareButton):
                     + ' make an AI image. Then wait.'
                     + ' Images will appear shortly.'
                     + '\r\nUntil then, enjoy some previous "promptography" images!')
+    if isHoldToTalk:
+        INSTRUCTIONS_TEXT = ('\r\nTRY ME NOW !\rAn Interactive Art Exhibit\n\rWhen you are ready, press the'
+                    + ' button and hold it down while you speak a few words to use to make an AI image.'
+                    + ' Then release the button and wait. Images will appear shortly.'
+                    + '\r\nUntil then, enjoy some previous "promptography" images!')
 
     labelTextLong = tk.Label(gw.windowMain, text=INSTRUCTIONS_TEXT, 
                      font=("Helvetica", 28),
@@ -1050,6 +3497,86 @@ def display_text_in_message_window(message=None, labelToUse=None):
     gw.windowForMessages.update()
 
 
+def display_pil_image(img, label):
+    '''
+    display a PIL image in the window using the label object, sized to fit the window
+    '''
+
+    global gw
+
+    #resize the image to fit the window
+    resizeFactor = 0.95
+    window_height = gw.windowMain.winfo_height()
+    labelDimensions = int(window_height * resizeFactor)
+    label.configure(width=labelDimensions, height=labelDimensions)
+    
+    # the longer side fills the label, for pictures that aren't square
+    scale = labelDimensions / max(img.width, img.height)
+    new_width = int(img.width * scale)
+    new_height = int(img.height * scale)
+    img = img.resize((new_width,new_height), Image.NEAREST)
+
+    # Convert the image to a PhotoImage
+    # (replacing the label's image in one step, so there is no blank moment in between)
+    photoImage = ImageTk.PhotoImage(img)
+    label.configure(image=photoImage)
+    label.image = photoImage  # Keep a reference to the image to prevent it from being garbage collected
+
+
+class ProgressiveDisplay:
+    '''
+    Fills in the picture a tile at a time while the images are still downloading, so the visitor
+    sees the first one as soon as it arrives instead of waiting for all of them. The tiles go where
+    the compositor will put them. Tiles can be added from any thread; they are put on the screen by
+    a tkinter timer, which runs whenever the windows are updated (stageDeadlines.run and the async
+    pipeline keep them updated while the images download). The caption is left off: it comes with
+    the finished picture, which is displayed over this one as normal. If making the picture fails,
+    cancel() puts back what was showing before.
+    '''
+
+    def __init__(self, label):
+        self.label = label
+        self.canvas = compositor.blankCanvas()
+        self.tiles = Queue()
+        self.previousImage = getattr(label, "image", None)
+        self.isRunning = False
+        self.timer = None
+
+    def addTile(self, index, img):
+        '''called as each tile arrives, from whichever thread downloaded it'''
+        self.tiles.put((index, img))
+
+    def start(self):
+        self.isRunning = True
+        self.timer = self.label.after(int(TK_UPDATE_INTERVAL * 1000), self.showNewTiles)
+
+    def showNewTiles(self):
+        isChanged = False
+        while not self.tiles.empty():
+            index, img = self.tiles.get()
+            compositor.pasteTile(self.canvas, index, img)
+            isChanged = True
+        if isChanged:
+            display_pil_image(self.canvas, self.label)
+
+        if self.isRunning:
+            self.timer = self.label.after(int(TK_UPDATE_INTERVAL * 1000), self.showNewTiles)
+
+    def stop(self):
+        '''stop updating; the finished picture is about to be displayed over the tiles'''
+        self.isRunning = False
+        if self.timer is not None:
+            self.label.after_cancel(self.timer)
+            self.timer = None
+
+    def cancel(self):
+        '''stop, and put back the picture that was showing before'''
+        self.stop()
+        if self.previousImage is not None:
+            self.label.configure(image=self.previousImage)
+            self.label.image = self.previousImage
+
+
 def display_image(image_path, label=None):
     '''
     display an image in the window using the label object
@@ -1067,20 +3594,7 @@ def display_image(image_path, label=None):
     # Open an image file
     try:
         img = Image.open(image_path)
-        #resize the image to fit the window
-        resizeFactor = 0.95
-        window_height = gw.windowMain.winfo_height()
-        labelDimensions = int(window_height * resizeFactor)
-        label.configure(width=labelDimensions, height=labelDimensions)
-        
-        new_width = int(labelDimensions * img.width / img.height)
-        new_height = int(labelDimensions)
-        img = img.resize((new_width,new_height), Image.NEAREST)
-
-        # Convert the image to a PhotoImage
-        photoImage = ImageTk.PhotoImage(img)
-        label.configure(image=photoImage)
-        label.image = photoImage  # Keep a reference to the image to prevent it from being garbage collected
+        display_pil_image(img, label)
 
         update_main_window()
 
@@ -1136,6 +3650,33 @@ def parseCommandLineArgs():
     parser.add_argument("-i", "--image", help="use image from file", type=str, default=0) # optional argument
     parser.add_argument("-o", "--onlykeywords", help="use audio directly without extracting keywords", action="store_true") # optional argument
     parser.add_argument("-g", "--gokiosk", help="jump into Kiosk mode", action="store_true") # optional argument
+    parser.add_argument("-p", "--holdtotalk", help="with the hardware button, record while the button is held down", action="store_true") # optional argument
+    parser.add_argument("--novad", help="always record the full duration, don't stop when the speaker goes quiet", action="store_true") # optional argument
+    parser.add_argument("--nocontinuous", help="in auto mode, stop recording while each picture is made", action="store_true") # optional argument
+    parser.add_argument("--silencegate", help="seconds of speech needed before a recording is transcribed, 0 to always transcribe", type=float, default=SILENCE_GATE_MIN_SPEECH) # optional argument
+    parser.add_argument("--nochunks", help="transcribe long recordings in one piece after recording ends", action="store_true") # optional argument
+    parser.add_argument("--nocache", help="always call OpenAI, don't use results saved in the cache folder", action="store_true") # optional argument
+    parser.add_argument("--hedge", help="send a second image request when the first is unusually slow", action="store_true") # optional argument
+    parser.add_argument("--norolling", help="in auto mode, make each picture from its own segment only", action="store_true") # optional argument
+    parser.add_argument("--imagecachematch", help="how alike keywords must be (0 to 1) to reuse an earlier picture", type=float, default=IMAGE_CACHE_MATCH_THRESHOLD) # optional argument
+    parser.add_argument("--record", help="record OpenAI results and images to the named cassette", type=str, default=None) # optional argument
+    parser.add_argument("--replay", help="replay OpenAI results and images from the named cassette, no network needed", type=str, default=None) # optional argument
+    parser.add_argument("--replayfast", help="with --replay, don't wait as long as the recorded calls took", action="store_true") # optional argument
+    parser.add_argument("--rpm", help="most OpenAI requests to make a minute", type=int, default=RATE_LIMIT_REQUESTS_PER_MINUTE) # optional argument
+    parser.add_argument("--ipm", help="most images to ask for a minute", type=int, default=RATE_LIMIT_IMAGES_PER_MINUTE) # optional argument
+    parser.add_argument("--budget", help="most dollars to spend a day (estimated), 0 for no limit", type=float, default=DAILY_SPEND_BUDGET) # optional argument
+    parser.add_argument("--nodeadlines", help="let each step of the pipeline take as long as it takes", action="store_true") # optional argument
+    parser.add_argument("--async", dest="asyncpipeline", help="run live recordings through the asyncio pipeline", action="store_true") # optional argument
+    parser.add_argument("--speculate", help="start the images before the keywords are back, at some extra cost", action="store_true") # optional argument
+    parser.add_argument("--keywordbackend", help="where keywords come from", choices=["llm", "local", "auto"], default="llm") # optional argument
+    parser.add_argument("--imageformat", help="have images sent as links to download, or inline in the response", choices=["url", "b64_json"], default="url") # optional argument
+    parser.add_argument("--benchmarkimages", help="time N image requests with each image format, then exit", type=int, nargs="?", const=3, default=0) # optional argument
+    parser.add_argument("--comparekeywords", help="compare local keywords with the ones logged in a log file, then exit", type=str, nargs="?", const="s2plog.log", default=None) # optional argument
+    parser.add_argument("--tiles", help="how many images make up each picture", type=int, choices=range(1, 11), default=IMAGES_PER_REQUEST) # optional argument
+    parser.add_argument("--grid", help="how the images are laid out, as COLUMNSxROWS", type=str, default=None) # optional argument
+    parser.add_argument("--tilesize", help="size of each image in pixels", type=int, choices=sorted(IMAGE_COSTS_BY_SIZE), default=COMPOSITE_TILE_SIZE) # optional argument
+    parser.add_argument("--outputsize", help="width of the finished picture in pixels (at least 64 a column), 0 for the images at full size", type=int, default=0) # optional argument
+    parser.add_argument("--uploadformat", help="how audio is sent for transcription", choices=["flac", "wav", "original"], default="flac") # optional argument
     args = parser.parse_args()
 
     # set the debug level
@@ -1153,6 +3694,48 @@ def parseCommandLineArgs():
     # if true, don't ask user for input, rely on hardware buttons
     rtn.isUsingHardwareButtons = False
 
+    rtn.isHoldToTalk = args.holdtotalk
+    rtn.isEndOnSilence = not args.novad
+    rtn.isContinuousCapture = not args.nocontinuous
+    rtn.silenceGateSeconds = args.silencegate
+    rtn.isChunkedTranscription = not args.nochunks
+    rtn.isUsingCache = not args.nocache
+    rtn.isHedgingImages = args.hedge
+    rtn.isRollingSummary = not args.norolling
+    rtn.imageCacheMatch = args.imagecachematch
+    rtn.requestsPerMinute = args.rpm
+    rtn.imagesPerMinute = args.ipm
+    rtn.dailyBudget = args.budget
+    rtn.isUsingDeadlines = not args.nodeadlines
+    if args.replay is not None:
+        rtn.cassetteMode = "replay"
+        rtn.cassetteName = args.replay
+    elif args.record is not None:
+        rtn.cassetteMode = "record"
+        rtn.cassetteName = args.record
+    rtn.isReplayDelayed = not args.replayfast
+    rtn.isAsyncPipeline = args.asyncpipeline
+    rtn.uploadFormat = args.uploadformat
+    rtn.keywordBackend = args.keywordbackend
+    rtn.isSpeculativeImages = args.speculate
+    rtn.compareKeywordsLog = args.comparekeywords
+    rtn.imageResponseFormat = args.imageformat
+    rtn.benchmarkImageCount = args.benchmarkimages
+    rtn.tileCount = args.tiles
+    if args.grid is not None:
+        try:
+            columns, rows = (int(n) for n in args.grid.lower().split("x"))
+        except ValueError:
+            parser.error("--grid should be COLUMNSxROWS, like 2x2")
+        if columns * rows < args.tiles:
+            parser.error(f"--grid {args.grid} has no room for {args.tiles} tiles")
+        rtn.tileGrid = (columns, rows)
+    rtn.tileSize = args.tilesize
+    columns = (rtn.tileGrid or Compositor.defaultGrid(args.tiles))[0]
+    if args.outputsize != 0 and args.outputsize < columns * COMPOSITE_MIN_CELL_SIZE:
+        parser.error(f"--outputsize should be 0 or at least {columns * COMPOSITE_MIN_CELL_SIZE} pixels for {columns} columns")
+    rtn.outputWidth = args.outputsize
+
     if args.gokiosk:
         # jump into Kiosk mode
         print("\r\nKiosk mode enabled\r\n")
@@ -1194,17 +3777,21 @@ def parseCommandLineArgs():
     return rtn
 
 
-def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, labelForStatusDisplay, filePrefix):
+def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, labelForStatusDisplay, filePrefix,
+                   continuousCapture=None):
     '''
     main routine to process audio to picture
+    if continuousCapture is given, the audio is the next segment it has recorded
     '''
     # format a time string to use as a file name
     timestr = time.strftime("%Y%m%d-%H%M%S")
 
-    soundFileName = ""
+    audio = None
+    transcriber = None
     transcript = ""
     summary = ""
     keywords = ""
+    speculation = None
     imageURLs = ""
     newImageFileName = ""
 
@@ -1216,7 +3803,7 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
 
     if nextProcessStep == processStep.UseAudioFile:
         # use the audio file specified 
-        soundFileName = settings.inputFileName
+        audio = settings.inputFileName
         logger.info("Using audio file: " + settings.inputFileName)
         nextProcessStep = processStep.Transcribe
 
@@ -1255,45 +3842,135 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
     # Each step changes the nextProcessStep to the next step in the pipeline
     # The code above can set the nextProcessStep to a specific step to skip steps in the pipeline
 
-    # Audio - get a recording.wav file
+    # Audio - get an in-memory recording
+    if nextProcessStep == processStep.CaptureAudio and rateLimiter.isOverBudget():
+        # don't ask the visitor to talk if we can't make their picture
+        display_text_in_message_window(BUDGET_MESSAGE, labelForMessageDisplay)
+        time.sleep(5)
+        display_text_in_message_window() # Hide the message window
+        update_main_window()
+        nextProcessStep = processStep.Done
+
     if nextProcessStep == processStep.CaptureAudio:
 
         changeBlinkRate(BLINK_FOR_AUDIO_CAPTURE)
 
-        # record audio from the default microphone
-        display_text_in_message_window("Speak Now\r\nYou have 10 seconds", labelForMessageDisplay)
-        if g_isMacOS: os.system('say "Recording."')
-        soundFileName = recordAudioFromMicrophone(settings.duration)
-        display_text_in_message_window("Recording Complete, now analyzing", labelForMessageDisplay)
-        if g_isMacOS: os.system('say "Recording complete."')
+        # get the connections we'll need ready while the visitor talks
+        prewarmConnections()
+
+        if continuousCapture is not None:
+            # the microphone is already running, wait for the next finished segment
+            display_text_in_message_window("Listening...", labelForMessageDisplay)
+            captureSeconds = stageDeadlines.seconds("capture", settings.duration)
+            captureStartTime = time.time()
+            segment = None
+            while segment is None and not gw.isQuitting:
+                segment = continuousCapture.getSegment(timeout=0.1)
+                update_main_window()
+                if segment is None and captureSeconds is not None and time.time() - captureStartTime > captureSeconds:
+                    stageDeadlines.recordExpiry("capture", captureSeconds)
+                    break
+            if segment is not None:
+                audio, transcriber = segment
+            display_text_in_message_window("Now analyzing", labelForMessageDisplay)
+
+        elif settings.isHoldToTalk and settings.isUsingHardwareButtons and not g_isMacOS:
+            # the button is down; record until the visitor lets go of it
+            display_text_in_message_window("Speak Now\r\nLet go of the button when you are done", labelForMessageDisplay)
+            try:
+                audio = stageDeadlines.run("capture", recordAudioFromMicrophone, HOLD_TO_TALK_MAX,
+                                           shouldStop=makeButtonReleasedCheck(), extraTime=HOLD_TO_TALK_MAX)
+            except StageDeadlineExpired:
+                audioEngine.waitUntilStopped()
+                audio = None
+            display_text_in_message_window("Recording Complete, now analyzing", labelForMessageDisplay)
+
+        else:
+            # record audio from the default microphone
+            display_text_in_message_window(f"Speak Now\r\nYou have {settings.duration} seconds", labelForMessageDisplay)
+            if g_isMacOS: os.system('say "Recording."')
+            # short keyword recordings can end as soon as the speaker is done
+            endOnSilence = settings.isEndOnSilence and settings.isAudioKeywords
+            # long recordings start being transcribed while they are recorded
+            transcriber = makeChunkedTranscriber(settings)
+            try:
+                audio = stageDeadlines.run("capture", recordAudioFromMicrophone, settings.duration, endOnSilence,
+                                           transcriber.addBlock if transcriber is not None else None,
+                                           extraTime=settings.duration)
+            except StageDeadlineExpired:
+                audioEngine.waitUntilStopped()
+                audio = None
+            display_text_in_message_window("Recording Complete, now analyzing", labelForMessageDisplay)
+            if g_isMacOS: os.system('say "Recording complete."')
+
+        if audio is None:
+            # quitting while waiting for a segment, or the microphone didn't deliver in time
+            if transcriber is not None:
+                transcriber.cancel()
+            display_text_in_message_window() # Hide the message window
+            changeBlinkRate(BLINK_STOP)
+            return
 
         if settings.isSaveFiles:
-            print("Saving audio file: " + soundFileName)
-            #copy the file to a new name with the time stamp
-            shutil.copy(soundFileName, "history/" + filePrefix + timestr + "-recording" + ".wav")
-            soundFileName = "history/" + filePrefix + timestr + "-recording" + ".wav"
+            audioFileName = "history/" + filePrefix + timestr + "-recording" + ".wav"
+            print("Saving audio file: " + audioFileName)
+            saveFileInBackground(audioFileName, audio.getvalue())
     
         changeBlinkRate(BLINK_STOP)
         nextProcessStep = processStep.Transcribe
 
 
+    # Silence gate - don't pay to transcribe and draw an empty room
+    if nextProcessStep == processStep.Transcribe and not isSpeechInRecording(audio, settings):
+
+        if transcriber is not None:
+            transcriber.cancel()
+        display_text_in_message_window(NO_SPEECH_MESSAGE, labelForMessageDisplay)
+        time.sleep(3)
+        display_text_in_message_window() # Hide the message window
+        update_main_window()
+
+        changeBlinkRate(BLINK_STOP)
+        nextProcessStep = processStep.Done
+
     # Transcribe - set transcript
     if nextProcessStep == processStep.Transcribe:
     
         changeBlinkRate(BLINK1)
+        showRateLimitWait(labelForMessageDisplay)
 
         # transcribe the recording
-        transcript = getTranscript(soundFileName)
-        logToFile.info("Transcript: " + transcript)
+        failMessage = DEADLINE_MESSAGE
+        try:
+            transcript = stageDeadlines.run("transcribe", transcribeRecording, audio, transcriber, settings.uploadFormat)
+        except StageDeadlineExpired:
+            # give up on this one rather than keep the visitor waiting
+            if transcriber is not None:
+                transcriber.cancel()
+            transcript = None
+        except SpendBudgetExceeded:
+            # the day's budget ran out while the visitor was talking
+            if transcriber is not None:
+                transcriber.cancel()
+            transcript = None
+            failMessage = BUDGET_MESSAGE
+
+        if transcript is None:
+            display_text_in_message_window(failMessage, labelForMessageDisplay)
+            time.sleep(3)
+            display_text_in_message_window() # Hide the message window
+            update_main_window()
+            nextProcessStep = processStep.Done
 
-        if settings.isSaveFiles:
-            f = open("history/" + filePrefix + timestr + "-rawtranscript" + ".txt", "w")
-            f.write(transcript)
-            f.close()
+        else:
+            logToFile.info("Transcript: " + transcript)
 
-        msg = f'I heard you say:\n\r "{transcript}" \n\r\n\rNow we wait for the images.'
-        display_text_in_message_window(msg, labelForMessageDisplay)
-        nextProcessStep = processStep.Summarize
+            if settings.isSaveFiles:
+                saveFileInBackground("history/" + filePrefix + timestr + "-rawtranscript" + ".txt", transcript)
+
+            msg = f'I heard you say:\n\r "{transcript}" \n\r\n\rNow we wait for the images.'
+            display_text_in_message_window(msg, labelForMessageDisplay)
+            nextProcessStep = processStep.Summarize
 
         changeBlinkRate(BLINK_STOP)
     
@@ -1311,6 +3988,12 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
     if nextProcessStep == processStep.Summarize:
         nextProcessStep = processStep.Keywords
 
+        # in auto mode the keywords can draw on the conversation so far; this segment is
+        # folded into the running summary in the background, ready for the next one
+        if settings.isRollingSummary and settings.numLoops > 1:
+            summary = rollingSummary.context()
+            rollingSummary.foldInBackground(transcript)
+
         """ Skip summarization for now
         changeBlinkRate(BLINK2)
 
@@ -1343,33 +4026,83 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
         # does transcript contain more than 20 blank spaces?
         if transcript.count(" ") > 20:
             # extract the keywords from the summary
-            keywords = getAbstractForImageGen(transcript) 
-            logToFile.info("Keywords: " + keywords)
-
-            if settings.isSaveFiles:
-                f = open("history/" + filePrefix + timestr + "-keywords" + ".txt", "w")
-                f.write(keywords)
-                f.close()
+            try:
+                keywords = ""
+                if isUsingLocalKeywords(transcript, settings.keywordBackend):
+                    keywords = getLocalKeywords(transcript)
+                if not keywords:
+                    # a transcript of nothing but stopwords has no local keywords, so ask the chat model
+                    if settings.isSpeculativeImages:
+                        # start on the images now, the keywords decide later if they will do
+                        speculation = imageSpeculation.start(transcript)
+                    showRateLimitWait(labelForMessageDisplay)
+                    keywords = stageDeadlines.run("keywords", getAbstractForImageGen,
+                                                  addConversationContext(transcript, summary))
+            except StageDeadlineExpired:
+                # the start of the transcript will do, short recordings use the transcript anyway
+                keywords = " ".join(transcript.split()[:DEADLINE_FALLBACK_WORDS])
+            except SpendBudgetExceeded:
+                # no picture can be made today, so there is nothing to make keywords for
+                keywords = None
+
+            if keywords is not None:
+                logToFile.info("Keywords: " + keywords)
+
+                if settings.isSaveFiles:
+                    saveFileInBackground("history/" + filePrefix + timestr + "-keywords" + ".txt", keywords)
         else:
             keywords = transcript
         
         changeBlinkRate(BLINK_STOP)
         nextProcessStep = processStep.ImageCreate
 
+        if keywords is None:
+            if speculation is not None:
+                imageSpeculation.abandon(speculation, "the day's budget is spent")
+            display_text_in_message_window(BUDGET_MESSAGE, labelForMessageDisplay)
+            time.sleep(5) # delay for 5 seconds
+            display_text_in_message_window() # Hide the message window
+            update_main_window()
+            nextProcessStep = processStep.Done
+
+    # Image cache - a picture made before for much the same keywords can be shown right away
+    if nextProcessStep == processStep.ImageCreate:
+        cachedFileName = imageCache.find(keywords)
+        if cachedFileName is not None:
+            if speculation is not None:
+                imageSpeculation.abandon(speculation, "picture from the image cache")
+            newImageFileName = cachedFileName
+            logToFile.info("Image file: " + newImageFileName)
+            nextProcessStep = processStep.DisplayImage
+
     # Image - set imageURL
     if nextProcessStep == processStep.ImageCreate:
 
         changeBlinkRate(BLINK4)
 
+        # the images are downloaded once generated, connect to their host in the meantime
+        prewarmConnections([imageHostURL])
+        if speculation is None:
+            showRateLimitWait(labelForMessageDisplay, compositor.tileCount)
+
         # use the keywords to generate images
         try:
-            imagesInfo = getImageURL(keywords)
+            imagesInfo, keywords = stageDeadlines.run("image", makeImages, keywords, speculation)
 
             imageURLs = imagesInfo[0]
             imageModifiers = imagesInfo[1]
 
-            # combine the images into one image
-            newImageFileName = postProcessImages(imageURLs, imageModifiers, keywords, timestr, filePrefix)
+            # combine the images into one image, showing each one as soon as it is here
+            progressiveDisplay = ProgressiveDisplay(labelForImageDisplay)
+            progressiveDisplay.start()
+            try:
+                newImageFileName = postProcessImages(imageURLs, imageModifiers, keywords, timestr, filePrefix,
+                                                     settings.isSaveFiles, progressiveDisplay.addTile)
+            except Exception:
+                progressiveDisplay.cancel()
+                raise
+            progressiveDisplay.stop()
+            imageCache.add(keywords, newImageFileName)
 
             imageURLs = "file://" + os.getcwd() + "/" + newImageFileName
             logger.debug("imageURL: " + imageURLs)
@@ -1384,17 +4117,7 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
             print ("AI Image Error: " + str(e))
             logToFile.info("AI Image Error: " + str(e), exc_info=True)
 
-            if 'content_policy_violation' in str(e):
-                # this is a common error, so we'll display a message to the user
-                msg = f'Content Policy Violation.  Your prompt may contain text that is not allowed by our safety system.'
-            elif 'something went wrong' in str(e):
-                msg = f'Something went wrong with the OpenAI image generation.  Please try again'
-            elif 'server had an error' in str(e):
-                msg = f'OpenAI had an unspecified server error.  Please try again'
-            else:
-                msg = f'We had an error:\n\r "{str(e)}" \n\r\n\rPlease try again.'
-
-            display_text_in_message_window(msg, labelForMessageDisplay)
+            display_text_in_message_window(imageErrorMessage(e), labelForMessageDisplay)
             time.sleep(5) # delay for 5 seconds
             display_text_in_message_window() # Hide the message window
             update_main_window()
@@ -1409,6 +4132,8 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
         changeBlinkRate(BLINK_SLOW)
         logger.info("Displaying image...")
 
+        # tkinter has to be used from the main thread, so the display can't be cut short; just record it
+        displayStartTime = time.time()
         try:
             display_image(newImageFileName, labelForImageDisplay)
             display_text_in_message_window() # Hide the message window
@@ -1417,17 +4142,267 @@ def audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, label
             logger.error(e)
     
         update_main_window()
+        stageDeadlines.checkElapsed("display", displayStartTime)
         
         changeBlinkRate(BLINK_STOP)
         nextProcessStep = processStep.Done
 
     if nextProcessStep == processStep.Done:
         # done with processing
-        pass
+        logger.info(httpStats.stats())
 
     return 
 
 
+def runAsyncPipeline(coroutine):
+    '''
+    run a pipeline coroutine to completion on asyncLoop and return its result. While it runs,
+    the tkinter windows are updated every TK_UPDATE_INTERVAL seconds so the display stays alive
+    while we wait on the microphone and the network.
+    '''
+    global asyncLoop
+
+    if asyncLoop is None:
+        asyncLoop = asyncio.new_event_loop()
+
+    async def keepWindowsUpdated():
+        while not gw.isQuitting:
+            update_main_window()
+            await asyncio.sleep(TK_UPDATE_INTERVAL)
+
+    async def runWithWindows():
+        windowTask = asyncio.create_task(keepWindowsUpdated())
+        try:
+            return await coroutine
+        finally:
+            windowTask.cancel()
+
+    return asyncLoop.run_until_complete(runWithWindows())
+
+
+async def audioToPictureAsync(settings, labelForImageDisplay, labelForMessageDisplay, labelForStatusDisplay, filePrefix,
+                              continuousCapture=None):
+    '''
+    audioToPicture for a live recording, written as a coroutine for runAsyncPipeline.
+    Each stage calls the same function as audioToPicture, on a thread through stageDeadlines.runInThread,
+    so the two pipelines have the same deadlines, budget and error handling.
+    '''
+    # format a time string to use as a file name
+    timestr = time.strftime("%Y%m%d-%H%M%S")
+
+    audio = None
+    transcriber = None
+
+    if rateLimiter.isOverBudget():
+        # don't ask the visitor to talk if we can't make their picture
+        display_text_in_message_window(BUDGET_MESSAGE, labelForMessageDisplay)
+        await asyncio.sleep(5)
+        display_text_in_message_window() # Hide the message window
+        return
+
+    # get the connections we'll need ready while the visitor talks
+    prewarmConnections()
+
+    # Audio - get an in-memory recording
+    changeBlinkRate(BLINK_FOR_AUDIO_CAPTURE)
+
+    if continuousCapture is not None:
+        # the microphone is already running, wait for the next finished segment
+        display_text_in_message_window("Listening...", labelForMessageDisplay)
+
+        async def waitForSegment():
+            segment = None
+            while segment is None and not gw.isQuitting:
+                segment = continuousCapture.getSegment(timeout=0)
+                await asyncio.sleep(0.1)
+            return segment
+
+        try:
+            segment = await stageDeadlines.runAsync("capture", waitForSegment(), extraTime=settings.duration)
+        except StageDeadlineExpired:
+            segment = None
+        if segment is not None:
+            audio, transcriber = segment
+        display_text_in_message_window("Now analyzing", labelForMessageDisplay)
+
+    elif settings.isHoldToTalk and settings.isUsingHardwareButtons and not g_isMacOS:
+        # the button is down; record until the visitor lets go of it
+        display_text_in_message_window("Speak Now\r\nLet go of the button when you are done", labelForMessageDisplay)
+        try:
+            audio = await stageDeadlines.runInThread("capture", recordAudioFromMicrophone, HOLD_TO_TALK_MAX,
+                                                     shouldStop=makeButtonReleasedCheck(), extraTime=HOLD_TO_TALK_MAX)
+        except StageDeadlineExpired:
+            await asyncio.to_thread(audioEngine.waitUntilStopped)
+            audio = None
+        display_text_in_message_window("Recording Complete, now analyzing", labelForMessageDisplay)
+
+    else:
+        display_text_in_message_window(f"Speak Now\r\nYou have {settings.duration} seconds", labelForMessageDisplay)
+        if g_isMacOS: os.system('say "Recording."')
+        endOnSilence = settings.isEndOnSilence and settings.isAudioKeywords
+        transcriber = makeChunkedTranscriber(settings)
+        try:
+            audio = await stageDeadlines.runInThread("capture", recordAudioFromMicrophone, settings.duration,
+                                                     endOnSilence, transcriber.addBlock if transcriber is not None else None,
+                                                     extraTime=settings.duration)
+        except StageDeadlineExpired:
+            await asyncio.to_thread(audioEngine.waitUntilStopped)
+            audio = None
+        display_text_in_message_window("Recording Complete, now analyzing", labelForMessageDisplay)
+        if g_isMacOS: os.system('say "Recording complete."')
+
+    changeBlinkRate(BLINK_STOP)
+    if audio is None:
+        # quitting while waiting for a segment, or the microphone didn't deliver in time
+        if transcriber is not None:
+            transcriber.cancel()
+        display_text_in_message_window() # Hide the message window
+        return
+
+    if settings.isSaveFiles:
+        saveFileInBackground("history/" + filePrefix + timestr + "-recording" + ".wav", audio.getvalue())
+
+    # Silence gate - don't pay to transcribe and draw an empty room
+    if not isSpeechInRecording(audio, settings):
+        if transcriber is not None:
+            transcriber.cancel()
+        display_text_in_message_window(NO_SPEECH_MESSAGE, labelForMessageDisplay)
+        await asyncio.sleep(3)
+        display_text_in_message_window() # Hide the message window
+        return
+
+    # Transcribe
+    changeBlinkRate(BLINK1)
+    showRateLimitWait(labelForMessageDisplay)
+
+    try:
+        transcript = await stageDeadlines.runInThread("transcribe", transcribeRecording, audio, transcriber,
+                                                      settings.uploadFormat)
+    except (StageDeadlineExpired, SpendBudgetExceeded) as e:
+        # give up on this one rather than keep the visitor waiting
+        if transcriber is not None:
+            transcriber.cancel()
+        failMessage = BUDGET_MESSAGE if isinstance(e, SpendBudgetExceeded) else DEADLINE_MESSAGE
+        display_text_in_message_window(failMessage, labelForMessageDisplay)
+        await asyncio.sleep(3)
+        display_text_in_message_window() # Hide the message window
+        changeBlinkRate(BLINK_STOP)
+        return
+    logToFile.info("Transcript: " + transcript)
+
+    if settings.isSaveFiles:
+        saveFileInBackground("history/" + filePrefix + timestr + "-rawtranscript" + ".txt", transcript)
+
+    msg = f'I heard you say:\n\r "{transcript}" \n\r\n\rNow we wait for the images.'
+    display_text_in_message_window(msg, labelForMessageDisplay)
+    changeBlinkRate(BLINK_STOP)
+
+    # check for a voice command
+    isCommand = False
+    for keyword in voice_command_functions:
+        if keyword.lower() in transcript.lower():
+            voice_command_functions[keyword](labelForStatusDisplay)
+            print("voice command done")
+            isCommand = True
+    if isCommand:
+        return
+
+    # Summary - in auto mode the keywords can draw on the conversation so far
+    summary = ""
+    if settings.isRollingSummary and settings.numLoops > 1:
+        summary = rollingSummary.context()
+        rollingSummary.foldInBackground(transcript)
+
+    # Keywords
+    changeBlinkRate(BLINK3)
+    speculation = None
+    if transcript.count(" ") > 20:
+        try:
+            keywords = ""
+            if isUsingLocalKeywords(transcript, settings.keywordBackend):
+                keywords = getLocalKeywords(transcript)
+            if not keywords:
+                # a transcript of nothing but stopwords has no local keywords, so ask the chat model
+                if settings.isSpeculativeImages:
+                    # start on the images now, the keywords decide later if they will do
+                    speculation = imageSpeculation.start(transcript)
+                showRateLimitWait(labelForMessageDisplay)
+                keywords = await stageDeadlines.runInThread("keywords", getAbstractForImageGen,
+                                                            addConversationContext(transcript, summary))
+        except StageDeadlineExpired:
+            # the start of the transcript will do, short recordings use the transcript anyway
+            keywords = " ".join(transcript.split()[:DEADLINE_FALLBACK_WORDS])
+        except SpendBudgetExceeded:
+            # no picture can be made today, so there is nothing to make keywords for
+            if speculation is not None:
+                imageSpeculation.abandon(speculation, "the day's budget is spent")
+            display_text_in_message_window(BUDGET_MESSAGE, labelForMessageDisplay)
+            await asyncio.sleep(5)
+            display_text_in_message_window() # Hide the message window
+            changeBlinkRate(BLINK_STOP)
+            return
+        logToFile.info("Keywords: " + keywords)
+        if settings.isSaveFiles:
+            saveFileInBackground("history/" + filePrefix + timestr + "-keywords" + ".txt", keywords)
+    else:
+        keywords = transcript
+    changeBlinkRate(BLINK_STOP)
+
+    # Image
+    changeBlinkRate(BLINK4)
+    # a picture made before for much the same keywords can be shown right away
+    newImageFileName = imageCache.find(keywords)
+    if newImageFileName is not None:
+        if speculation is not None:
+            imageSpeculation.abandon(speculation, "picture from the image cache")
+        logToFile.info("Image file: " + newImageFileName)
+
+    else:
+        # the images are downloaded once generated, connect to their host in the meantime
+        prewarmConnections([imageHostURL])
+        if speculation is None:
+            showRateLimitWait(labelForMessageDisplay, compositor.tileCount)
+        try:
+            (imageURLs, imageModifiers), keywords = await stageDeadlines.runInThread("image", makeImages,
+                                                                                     keywords, speculation)
+            # show each image as soon as it is here
+            progressiveDisplay = ProgressiveDisplay(labelForImageDisplay)
+            progressiveDisplay.start()
+            try:
+                imgObjects = await stageDeadlines.runInThread("download", downloadImages, imageURLs,
+                                                              settings.isSaveFiles, progressiveDisplay.addTile)
+                newImageFileName = await stageDeadlines.runInThread("composite", compositeImages, imgObjects,
+                                                                    imageModifiers, keywords, timestr, filePrefix)
+            except Exception:
+                progressiveDisplay.cancel()
+                raise
+            progressiveDisplay.stop()
+            imageCache.add(keywords, newImageFileName)
+            logToFile.info("Image file: " + newImageFileName)
+
+        except Exception as e:
+            print ("AI Image Error: " + str(e))
+            logToFile.info("AI Image Error: " + str(e), exc_info=True)
+
+            display_text_in_message_window(imageErrorMessage(e), labelForMessageDisplay)
+            await asyncio.sleep(5) # delay for 5 seconds
+            display_text_in_message_window() # Hide the message window
+            changeBlinkRate(BLINK_STOP)
+            return
+
+    changeBlinkRate(BLINK_STOP)
+
+    # Display
+    changeBlinkRate(BLINK_SLOW)
+    logger.info("Displaying image...")
+    displayStartTime = time.time()
+    display_image(newImageFileName, labelForImageDisplay)
+    display_text_in_message_window() # Hide the message window
+    stageDeadlines.checkElapsed("display", displayStartTime)
+    changeBlinkRate(BLINK_STOP)
+    logger.info(httpStats.stats())
+
+
 def main():
     # ----------------------
     # main program starts here
@@ -1466,9 +4441,39 @@ def main():
 
     # args
     settings = parseCommandLineArgs() # get the command line arguments
+
+    transcriptCache.isEnabled = settings.isUsingCache
+    llmCache.isEnabled = settings.isUsingCache
+    imageCache.isEnabled = settings.isUsingCache
+    imageCache.matchThreshold = settings.imageCacheMatch
+    imagePolicy.isHedging = settings.isHedgingImages
+    imagePolicy.responseFormat = settings.imageResponseFormat
+    stageDeadlines.isEnabled = settings.isUsingDeadlines
+    rateLimiter.configure(settings.requestsPerMinute, settings.imagesPerMinute, settings.dailyBudget)
+    compositor.configure(settings.tileCount, settings.tileGrid, settings.tileSize, settings.outputWidth)
+    logToFile.info("Pictures are %d %s tiles in a %dx%d grid, %dx%d in all", compositor.tileCount,
+                   compositor.imageSize(), compositor.columns, compositor.rows, *compositor.size)
+    API_CALL_COSTS["Image"] = IMAGE_COSTS_BY_SIZE[settings.tileSize]
+
+    if settings.cassetteMode is not None:
+        cassette.open(settings.cassetteName, settings.cassetteMode, settings.isReplayDelayed)
+        # the cassette should see every call, not have the caches answer some of them
+        transcriptCache.isEnabled = False
+        llmCache.isEnabled = False
+        imageCache.isEnabled = False
+
+    if settings.compareKeywordsLog is not None:
+        # a tool for tuning the local keywords, no need for the windows
+        compareKeywordBackends(settings.compareKeywordsLog)
+        return
+
+    if settings.benchmarkImageCount:
+        # this makes real (paid for) image requests
+        benchmarkImageFormats(settings.benchmarkImageCount)
+        return
  
     # create the main window
-    labelForImageDisplay = create_main_window(settings.isUsingHardwareButtons)
+    labelForImageDisplay = create_main_window(settings.isUsingHardwareButtons, settings.isHoldToTalk)
 
     display_random_history_image(labelForImageDisplay) # display a random image
 
@@ -1480,8 +4485,8 @@ def main():
     labelForStatusDisplay = create_status_window()
     display_text_in_status_window() # hide the status window
 
-    # capture a second of audio to initialize driver on RPi
-    recordAudioFromMicrophone(.25)
+    # open the microphone once, it stays ready for every recording
+    audioEngine.open()
 
     # ----------------------
     # Main Loop 
@@ -1543,6 +4548,8 @@ def main():
                             settings.autoLoopDelay = 0
 
                         elif inputCommand == 'a': # auto mode
+                            lastCommandTime = time.time()
+                            settings.nextProcessStep = processStep.CaptureAudio
                             settings.numLoops = LOOPS_MAX
                             print("Will loop: " + str(settings.numLoops) + " times")
 
@@ -1576,12 +4583,21 @@ def main():
             if settings.isUsingHardwareButtons:
                 # we're not going to prompt the user for input, rely on hardware buttons
                 isButtonPressed = False
+                wasButtonDown = GPIO.input(BUTTON_GO) == BUTTON_PRESSED
 
                 while not isButtonPressed:
                     # running on RPi
                     update_main_window()
                     # read gpio pin, if pressed, then do a cycle of keyword input
-                    if GPIO.input(BUTTON_GO) == BUTTON_PRESSED:
+                    isButtonDown = GPIO.input(BUTTON_GO) == BUTTON_PRESSED
+                    if settings.isHoldToTalk:
+                        # recording starts as the button goes down, so wait for a new press
+                        isNewPress = isButtonDown and not wasButtonDown
+                    else:
+                        isNewPress = isButtonDown
+                    wasButtonDown = isButtonDown
+
+                    if isNewPress:
                         settings.isAudioKeywords = True
                         settings.numLoops = 1
                         isButtonPressed = True
@@ -1607,17 +4623,34 @@ def main():
         # we have a command. Either a command line file argument, a menu command, or a button press
         if executeImageGeneration:
 
+            # in auto mode keep the microphone recording while each segment is processed
+            continuousCapture = None
+            if (settings.isContinuousCapture and settings.numLoops > 1 
+                    and settings.nextProcessStep == processStep.CaptureAudio):
+                continuousCapture = ContinuousCapture(settings.duration, lambda: makeChunkedTranscriber(settings))
+                continuousCapture.start()
+
             # loop through a number of picture generation cycles
             for i in range(0, settings.numLoops, 1):
                 # this is where all the work happens
                 # collect audio, transcribe, summarize, extract keywords, generate images, display images
-                audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, labelForStatusDisplay, filePrefix)  # XXX
-
-                if not settings.isUsingHardwareButtons and settings.numLoops > 1: 
+                if settings.isAsyncPipeline and settings.nextProcessStep == processStep.CaptureAudio:
+                    runAsyncPipeline(audioToPictureAsync(settings, labelForImageDisplay, labelForMessageDisplay,
+                                                         labelForStatusDisplay, filePrefix, continuousCapture))
+                else:
+                    audioToPicture(settings, labelForImageDisplay, labelForMessageDisplay, labelForStatusDisplay, filePrefix,
+                                   continuousCapture)  # XXX
+
+                if (not settings.isUsingHardwareButtons and settings.numLoops > 1
+                        and continuousCapture is None): 
                     # delay before the next for loop iteration, we don't do this when using hardware buttons
+                    # or when recording continuously, since the next segment is already being recorded
                     print("delaying " + str(settings.autoLoopDelay) + " seconds...")
                     time.sleep(settings.autoLoopDelay)            
 
+            if continuousCapture is not None:
+                continuousCapture.stop()
+
         # let the tkinter window events happen
         update_main_window()
 
@@ -1632,6 +4665,13 @@ def main():
         # end of loop
 
     # all done
+    audioEngine.close()
+
+    httpClient.close()
+
+    if asyncLoop is not None:
+        asyncLoop.close()
+
     if not g_isMacOS:
         # running on RPi
         # Stop the LED thread
@@ -1648,17 +4688,19 @@ def main():
 '''
 Beginning of execution
 '''
-logToFile.info("Starting Speech2Picture")
+# only when run as a program, so the tests can import the functions
+if __name__ == "__main__":
+    logToFile.info("Starting Speech2Picture")
 
-try:
-    main()
-except Exception as e:
-    print("\n\n\n")
-    print(e)
-    print("\n\n\n")
-    logToFile.error(e, exc_info=True)
+    try:
+        main()
+    except Exception as e:
+        print("\n\n\n")
+        print(e)
+        print("\n\n\n")
+        logToFile.error(e, exc_info=True)
 
-exit()
+    exit()
 
 
 
@@ -0,0 +1,66 @@
+'''
+Once the day's budget is spent during a visitor's turn, the kiosk should say so and carry on,
+not stop. Needs the packages pyspeech uses and a display for its windows.
+'''
+import sys
+import types
+import wave
+
+import pytest
+
+pytest.importorskip("openai")
+tkinter = pytest.importorskip("tkinter")
+
+try:
+    import pyspeech
+except tkinter.TclError:
+    pytest.skip("no display for the windows", allow_module_level=True)
+
+
+def makeWav(fileName):
+    with wave.open(str(fileName), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"\0\0" * 16000)
+
+
+@pytest.fixture
+def kiosk(tmp_path, monkeypatch):
+    '''an audio file to transcribe, a tiny budget, a fake OpenAI client and no windows'''
+
+    monkeypatch.chdir(tmp_path)
+    makeWav(tmp_path / "visitor.wav")
+    monkeypatch.setattr(sys, "argv", ["pyspeech.py", "-w", "visitor.wav", "--budget", "0.00005",
+                                      "--silencegate", "0", "--nodeadlines", "--nocache", "--uploadformat", "original"])
+    settings = pyspeech.parseCommandLineArgs()
+    pyspeech.rateLimiter.configure(settings.requestsPerMinute, settings.imagesPerMinute, settings.dailyBudget)
+    pyspeech.stageDeadlines.isEnabled = settings.isUsingDeadlines
+    monkeypatch.setattr(pyspeech.transcriptCache, "isEnabled", False)
+
+    calls = []
+    def translate(**kwargs):
+        calls.append(kwargs)
+        return types.SimpleNamespace(text="a cat on the moon")
+    fakeClient = types.SimpleNamespace(audio=types.SimpleNamespace(translations=types.SimpleNamespace(create=translate)))
+    monkeypatch.setattr(pyspeech, "client", fakeClient)
+
+    messages = []
+    monkeypatch.setattr(pyspeech, "display_text_in_message_window", lambda message=None, labelToUse=None: messages.append(message))
+    monkeypatch.setattr(pyspeech, "changeBlinkRate", lambda blinkRate: None)
+    monkeypatch.setattr(pyspeech, "update_main_window", lambda: None)
+    monkeypatch.setattr(pyspeech.time, "sleep", lambda seconds: None)
+
+    return types.SimpleNamespace(settings=settings, calls=calls, messages=messages)
+
+
+def test_budget_spent_during_transcribe_ends_the_turn(kiosk):
+    # this transcription uses up the budget
+    assert pyspeech.getTranscript("visitor.wav") == "a cat on the moon"
+    assert pyspeech.rateLimiter.isOverBudget()
+
+    # so the next visitor is told, and the kiosk keeps going
+    pyspeech.audioToPicture(kiosk.settings, None, None, None, "T-")
+
+    assert len(kiosk.calls) == 1
+    assert pyspeech.BUDGET_MESSAGE in kiosk.messages